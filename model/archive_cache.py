@@ -0,0 +1,94 @@
+import collections
+import contextlib
+import threading
+
+class MemberCache:
+    """Implements a read-through LRU cache of decompressed archive members
+
+    Members are kept as bytes under a caller-chosen key until their total size exceeds
+    `budget` bytes, at which point the least recently read ones are dropped. Members larger
+    than the whole budget are never kept. `hits` and `misses` count the reads.
+    """
+
+    def __init__(self, budget=256 * 2 ** 20):
+        self.budget = budget
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self._members = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def read(self, key, load):
+        """Returns the cached member for `key`, calling `load()` to read it on a miss"""
+        with self._lock:
+            if key in self._members:
+                self._members.move_to_end(key)
+                self.hits += 1
+                return self._members[key]
+            self.misses += 1
+
+        data = bytes(load())
+
+        with self._lock:
+            if len(data) <= self.budget and key not in self._members:
+                self._members[key] = data
+                self.size += len(data)
+                while self.size > self.budget:
+                    _, evicted = self._members.popitem(last=False)
+                    self.size -= len(evicted)
+
+        return data
+
+    def clear(self):
+        with self._lock:
+            self._members.clear()
+            self.size = 0
+
+class MpqHandlePool:
+    """Implements a bounded pool of interchangeable open MPQ handles
+
+    `open_handle` is called to open a new handle (e.g. of all the game data files), since
+    a single handle can not be used from several threads at once. At most `size` handles
+    are in use at a time; further users wait for one to be returned. Returned handles are
+    kept open for reuse until `close`.
+    """
+
+    def __init__(self, open_handle, size=4):
+        self.open_handle = open_handle
+        self._idle = []
+        self._semaphore = threading.BoundedSemaphore(size)
+        self._lock = threading.Lock()
+
+    @contextlib.contextmanager
+    def open(self):
+        with self._semaphore:
+            with self._lock:
+                handle = self._idle.pop() if self._idle else None
+
+            if handle is None:
+                handle = self.open_handle()
+
+            try:
+                yield handle
+            except BaseException:
+                handle.close() # possibly in an inconsistent state
+                raise
+
+            with self._lock:
+                self._idle.append(handle)
+
+    def close(self):
+        with self._lock:
+            handles = self._idle
+            self._idle = []
+
+        for handle in handles:
+            handle.close()
+
+def read_member(handle, member):
+    """Reads a whole member out of an open MPQ archive"""
+    file = handle.open(member)
+    try:
+        return file.read()
+    finally:
+        file.close()
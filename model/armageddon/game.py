@@ -1,56 +1,114 @@
+import io
+import mmap
+import numpy
 import os
 import re
-import struct
 
 import game
 import armageddon.scenario
 
+HED_HEADER_DTYPE = numpy.dtype([('unknown', '<u4'), ('entry_count', '<u4')])
+HED_ENTRY_DTYPE = numpy.dtype([
+    ('offset', '<u4'),
+    ('filename', 'S63'),
+    ('filename_length', 'u1'),
+    ('length', '<u4'),
+])
+
 class MfpArchive:
-    def __init__(self, file_path):
+    """Implements read access to one or more memory-mapped MFP archives
+
+    Archives are merged into a single name index; when several of them contain the same
+    member, the one added last wins. Members are returned as `memoryview` slices of the
+    mapped archives, so reads do not copy the data and need no shared file position, which
+    makes them safe to use from multiple threads at once. Views of members have to be
+    released before the archive is closed.
+    """
+
+    def __init__(self, file_path=None):
+        self.entries = {}
+        self.archives = []
+        if file_path != None:
+            self.add_archive(file_path)
+
+    def add_archive(self, file_path):
         hed_file_path = re.sub('.mfp$', '.hed', file_path.lower())
         with open(hed_file_path, 'rb') as hed_file:
             hed_data = hed_file.read()
 
-        unknown, entry_count = struct.unpack_from('II', hed_data, 0)
+        entry_count = int(numpy.frombuffer(hed_data, HED_HEADER_DTYPE, count=1)[0]['entry_count'])
+        hed_entries = numpy.frombuffer(hed_data, HED_ENTRY_DTYPE, count=entry_count, offset=HED_HEADER_DTYPE.itemsize)
 
-        self.entries = {}
-        for i in range(entry_count):
-            offset = 72 * i + 8
-            file_offset = struct.unpack_from('I', hed_data, offset)[0]
-            file_length = struct.unpack_from('I', hed_data, offset + 68)[0]
-            filename_length = hed_data[offset + 67]
-            filename = hed_data[offset + 4: offset + filename_length + 4].decode('EUC-KR')
-
-            self.entries[filename] = HedEntry(file_offset, file_length)
+        with open(file_path, 'rb') as mfp_file:
+            data = mmap.mmap(mfp_file.fileno(), 0, access=mmap.ACCESS_READ)
+        archive = len(self.archives)
+        self.archives.append((data, memoryview(data)))
 
-        self.file = open(file_path, 'rb')
+        for filename, filename_length, offset, length in zip(*[
+                hed_entries[x].tolist() for x in ('filename', 'filename_length', 'offset', 'length')]):
+            self.entries[filename[:filename_length].decode('EUC-KR')] = HedEntry(archive, offset, length)
 
     def close(self):
-        self.file.close()
+        for data, view in self.archives:
+            view.release()
+            try:
+                data.close()
+            except BufferError:
+                pass # member views are still in use; the mapping is closed once they are released
+        self.archives = []
 
     def read_file(self, filename):
         entry = self.entries[filename]
-        self.file.seek(entry.offset)
-        return self.file.read(entry.length)
+        return self.archives[entry.archive][1][entry.offset: entry.offset + entry.length]
+
+    def open(self, filename):
+        return MfpMemberFile(self.read_file(filename))
 
     def __contains__(self, filename):
         return filename in self.entries
 
 class HedEntry:
-    def __init__(self, offset, length):
+    __slots__ = 'archive', 'offset', 'length'
+
+    def __init__(self, archive, offset, length):
+        self.archive = archive
         self.offset = offset
         self.length = length
 
-class Game(game.Game):
-    def load_data_file(self, data_file):
-        if hasattr(self, 'data'):
-            # TODO: handle multiple data files
-            raise Exception('Cannot handle multiple MFP files')
+class MfpMemberFile:
+    """Implements a read-only file object over an archive member without copying it"""
+
+    def __init__(self, data):
+        self.data = data
+        self.position = 0
+
+    def read(self, size=-1):
+        end = len(self.data) if size is None or size < 0 else min(self.position + size, len(self.data))
+        result = self.data[self.position: end]
+        self.position = max(self.position, end)
+        return result
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        if whence == io.SEEK_CUR:
+            offset += self.position
+        elif whence == io.SEEK_END:
+            offset += len(self.data)
+        self.position = max(offset, 0)
+        return self.position
 
-        self.data = MfpArchive(os.path.join(self.directory, data_file))
+    def tell(self):
+        return self.position
 
     def close(self):
-        self.data.close()
+        self.data.release()
+
+class Game(game.Game):
+    def __init__(self, game_directory):
+        self.data = MfpArchive()
+        super().__init__(game_directory)
+
+    def load_data_file(self, data_file):
+        self.data.add_archive(os.path.join(self.directory, data_file))
 
     @classmethod
     def data_files(cls):
@@ -1,5 +1,7 @@
 STARCRAFT_ROOT = 'C:/Games/StarCraft'
 
+SCENARIO_CACHE_DIRECTORY = '../data/scenario-cache'
+
 MAP_DIRECTORIES = [
     '../data/4-player-jungle',
     '../data/tiny-jungle-maps',
@@ -0,0 +1,125 @@
+import collections
+import heapq
+import numpy as np
+
+import sampler
+from tileset import pack_bitsets, unpack_bitsets
+
+POPCOUNT = np.array([bin(x).count('1') for x in range(256)], dtype=np.uint16)
+
+class GenerationError(Exception):
+    pass
+
+class ConstraintGenerator:
+    """Implements wave function collapse over the tile groups of a tileset
+
+    Every cell keeps a bitset (see `tileset.pack_bitsets`) of the tile groups it can still
+    hold. Collapsing a cell to a single group narrows down its neighbours by ANDing their
+    bitsets with the union of the compatibility rows (`TilesetData.right_compatible` and
+    `below_compatible`, plus their transposes) of the groups left in the cell. Cells that
+    change are queued and propagated in turn, so the generated grids only ever contain
+    matching edges.
+    """
+
+    def __init__(self, tileset, weights=None):
+        self.tileset = tileset
+        self.group_count = len(tileset.megagroup)
+        self.weights = np.ones(self.group_count) if weights is None else np.asarray(weights, dtype=np.float64)
+
+        right = unpack_bitsets(tileset.right_compatible, self.group_count)
+        below = unpack_bitsets(tileset.below_compatible, self.group_count)
+        # The groups allowed in the neighbour at each (row, column) offset, by group
+        self.compatible = {
+            (0, 1): tileset.right_compatible,
+            (1, 0): tileset.below_compatible,
+            (0, -1): pack_bitsets(right.T),
+            (-1, 0): pack_bitsets(below.T),
+        }
+        self.placeable = pack_bitsets(tileset.placeable.reshape(1, -1))[0]
+
+    def generate(self, height, width, random=np.random, attempts=10):
+        """Returns a [height, width] grid of tile indices with matching edges
+
+        Raises `GenerationError` when every attempt runs into a contradiction.
+        """
+        for _ in range(attempts):
+            try:
+                groups = self.generate_groups(height, width, random)
+            except GenerationError:
+                continue
+
+            # Pick one of the tiles with graphics from each group
+            offsets = sampler.categorical(1 - self.tileset.is_empty.reshape(-1, 16)[groups.reshape(-1)], random)
+            return (groups * 16 + offsets.reshape(groups.shape)).astype(np.uint16)
+
+        raise GenerationError('Could not generate a %dx%d grid in %d attempts' % (height, width, attempts))
+
+    def generate_groups(self, height, width, random=np.random):
+        """Returns a [height, width] grid of tile group ids with matching edges"""
+        possible = np.tile(self.placeable, [height, width, 1])
+        counts = np.full([height, width], self.count(self.placeable))
+        if counts[0, 0] == 0:
+            raise GenerationError('The tileset has no placeable groups')
+
+        # A heap of (choices left, random tie breaker, row, column) of the cells to collapse.
+        # Cells are pushed again whenever propagation narrows them down, so entries whose
+        # count no longer matches are stale and skipped.
+        tie_breakers = random.random_sample(counts.size)
+        heap = [(counts[0, 0], tie_breakers[i], i // width, i % width) for i in range(counts.size)]
+        heapq.heapify(heap)
+
+        while heap:
+            # Collapse the cell with the fewest choices left, breaking ties randomly
+            count, _, row, column = heapq.heappop(heap)
+            cell = row, column
+            if count <= 1 or count != counts[cell]:
+                continue
+
+            groups = self.groups(possible[cell])
+            weights = self.weights[groups]
+            group = groups[sampler.categorical(weights.reshape(1, -1), random)[0]]
+            possible[cell] = 0
+            possible[cell][group // 64] = np.uint64(1) << np.uint64(group % 64)
+            counts[cell] = 1
+
+            for changed in self.propagate(possible, counts, cell):
+                if counts[changed] > 1:
+                    heapq.heappush(heap, (counts[changed], random.random_sample(), changed[0], changed[1]))
+
+        return np.argmax(unpack_bitsets(possible, self.group_count), axis=-1)
+
+    def propagate(self, possible, counts, cell):
+        """Narrows down the neighbours of a changed cell, returning the cells that changed"""
+        height, width = counts.shape
+        changed = []
+        queue = collections.deque([cell])
+        while queue:
+            row, column = queue.popleft()
+            groups = self.groups(possible[row, column])
+
+            for (row_offset, column_offset), compatible in self.compatible.items():
+                neighbour = row + row_offset, column + column_offset
+                if not (0 <= neighbour[0] < height and 0 <= neighbour[1] < width):
+                    continue
+
+                allowed = possible[neighbour] & np.bitwise_or.reduce(compatible[groups], axis=0)
+                if np.array_equal(allowed, possible[neighbour]):
+                    continue
+
+                count = self.count(allowed)
+                if count == 0:
+                    raise GenerationError('No tile group fits at %r' % (neighbour,))
+
+                possible[neighbour] = allowed
+                counts[neighbour] = count
+                queue.append(neighbour)
+                changed.append(neighbour)
+
+        return changed
+
+    def groups(self, bitset):
+        return np.flatnonzero(unpack_bitsets(bitset, self.group_count))
+
+    @staticmethod
+    def count(bitset):
+        return int(POPCOUNT[bitset.view(np.uint8)].sum())
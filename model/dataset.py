@@ -0,0 +1,182 @@
+import json
+import numpy as np
+import os
+import queue
+import threading
+
+import features
+
+INDEX_DTYPE = np.dtype([
+    ('shard', '<u4'),
+    ('tiles_offset', '<u8'),
+    ('features_offset', '<u8'),
+    ('height', '<u2'),
+    ('width', '<u2'),
+])
+
+class DatasetWriter:
+    """Implements writing encoded scenarios into fixed-size binary shards
+
+    Every sample consists of a [height, width] uint16 grid of tile ids and a
+    [height, width, features] float32 feature map. Each is appended to the current
+    shard's `.tiles` and `.features` files respectively. A new shard is started once
+    the current one exceeds `shard_size` bytes. The index of all samples is written on
+    `close`.
+    """
+
+    def __init__(self, directory, feature_count, shard_size=256 * 2 ** 20):
+        self.directory = directory
+        self.feature_count = feature_count
+        self.shard_size = shard_size
+        os.makedirs(directory, exist_ok=True)
+
+        self.index = []
+        self.shard_count = 0
+        self._open_shard()
+
+    def add(self, tile_ids, tile_features):
+        tile_ids = np.ascontiguousarray(tile_ids, dtype='<u2')
+        tile_features = np.ascontiguousarray(tile_features, dtype='<f4')
+        height, width = tile_ids.shape
+        assert tile_features.shape == (height, width, self.feature_count)
+
+        if self._shard_bytes >= self.shard_size:
+            self._close_shard()
+            self._open_shard()
+
+        self.index.append((
+            self.shard_count - 1,
+            self._tiles_file.tell() // tile_ids.itemsize,
+            self._features_file.tell() // tile_features.itemsize,
+            height,
+            width,
+        ))
+        self._tiles_file.write(tile_ids.tobytes())
+        self._features_file.write(tile_features.tobytes())
+        self._shard_bytes += tile_ids.nbytes + tile_features.nbytes
+
+    def close(self):
+        self._close_shard()
+        np.save(os.path.join(self.directory, 'index.npy'), np.array(self.index, dtype=INDEX_DTYPE))
+        with open(os.path.join(self.directory, 'dataset.json'), 'w') as metadata_file:
+            json.dump({'feature_count': self.feature_count, 'shard_count': self.shard_count}, metadata_file)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exception):
+        self.close()
+
+    def _open_shard(self):
+        shard_path = os.path.join(self.directory, 'shard-%05d' % self.shard_count)
+        self._tiles_file = open(shard_path + '.tiles', 'wb')
+        self._features_file = open(shard_path + '.features', 'wb')
+        self._shard_bytes = 0
+        self.shard_count += 1
+
+    def _close_shard(self):
+        self._tiles_file.close()
+        self._features_file.close()
+
+def export(directory, scenarios, shard_size=256 * 2 ** 20):
+    """Writes scenarios as vocabulary tile ids plus `features.feature_map` features
+
+    `scenarios` can be any iterable (e.g. `Game.iter_scenarios`), only one scenario
+    is held in memory at a time. Returns the number of exported scenarios.
+    """
+    with DatasetWriter(directory, len(features.FEATURE_NAMES), shard_size) as writer:
+        for scenario in scenarios:
+            tileset = scenario.game.tiles(scenario.tileset)
+            tile_ids = tileset.to_vocabulary(scenario.tile_indices)
+            writer.add(tile_ids, features.feature_map(tileset, scenario.tile_indices))
+
+        return len(writer.index)
+
+class DatasetReader:
+    """Implements reading a dataset written by `DatasetWriter`
+
+    The shards are memory-mapped on first access, so the dataset does not need to fit
+    in memory. Samples are accessed by their position in the index.
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+        self.index = np.load(os.path.join(directory, 'index.npy'))
+        with open(os.path.join(directory, 'dataset.json')) as metadata_file:
+            metadata = json.load(metadata_file)
+        self.feature_count = metadata['feature_count']
+
+        self._tiles = {}
+        self._features = {}
+
+    def __len__(self):
+        return len(self.index)
+
+    def __getitem__(self, sample):
+        """Returns a (tile ids, features) tuple of read-only memory-mapped arrays"""
+        shard, tiles_offset, features_offset, height, width = self.index[sample]
+        if shard not in self._tiles:
+            shard_path = os.path.join(self.directory, 'shard-%05d' % shard)
+            self._tiles[shard] = np.memmap(shard_path + '.tiles', dtype='<u2', mode='r')
+            self._features[shard] = np.memmap(shard_path + '.features', dtype='<f4', mode='r')
+
+        tile_count = int(height) * int(width)
+        tile_ids = self._tiles[shard][tiles_offset: tiles_offset + tile_count]
+        tile_features = self._features[shard][features_offset: features_offset + tile_count * self.feature_count]
+        return tile_ids.reshape([height, width]), tile_features.reshape([height, width, self.feature_count])
+
+    def batches(self, batch_size, epochs, random=np.random, prefetch=4):
+        """Yields (tile ids, features) batches of stacked samples
+
+        Samples are grouped by map size, since a batch can only hold maps of the same
+        size, and incomplete batches are dropped. The batches of each epoch are shuffled
+        across all shards. Up to `prefetch` batches are assembled ahead of time on a
+        background thread.
+        """
+        batches = queue.Queue(maxsize=prefetch)
+        stop = threading.Event()
+
+        def put(item):
+            """Waits for room in the queue, giving up once the consumer has stopped"""
+            while not stop.is_set():
+                try:
+                    batches.put(item, timeout=0.1)
+                    return True
+                except queue.Full:
+                    pass
+            return False
+
+        def produce():
+            try:
+                for epoch in range(epochs):
+                    for batch in self._epoch_batches(batch_size, random):
+                        samples = [self[x] for x in batch]
+                        if not put((np.stack([x[0] for x in samples]), np.stack([x[1] for x in samples]))):
+                            return
+                put(None)
+            except Exception as e:
+                put(e)
+
+        producer = threading.Thread(target=produce, daemon=True)
+        producer.start()
+        try:
+            while True:
+                item = batches.get()
+                if item is None:
+                    break
+                if isinstance(item, Exception):
+                    raise item
+                yield item
+        finally:
+            stop.set()
+            producer.join()
+
+    def _epoch_batches(self, batch_size, random):
+        shapes = self.index['height'].astype(np.uint32) << 16 | self.index['width']
+        batches = []
+        for shape in np.unique(shapes):
+            samples = random.permutation(np.flatnonzero(shapes == shape))
+            batch_count = len(samples) // batch_size
+            batches += np.split(samples[: batch_count * batch_size], batch_count) if batch_count else []
+
+        return [batches[x] for x in random.permutation(len(batches))]
@@ -0,0 +1,172 @@
+import numpy as np
+
+FEATURE_NAMES = (
+    'average_height',
+    'min_height',
+    'walkable',
+    'ramp',
+    'blocks_view',
+    'buildable',
+    'kind',
+    'variant',
+    'is_doodad',
+)
+
+def feature_table(tileset):
+    """Returns the [tiles, len(FEATURE_NAMES)] feature table of a tileset
+
+    The table is built once per tileset and kept on it (see `TilesetData.feature_table`).
+    """
+    return tileset.feature_table
+
+def build_feature_table(tileset):
+    """Returns a [tiles, len(FEATURE_NAMES)] float32 table of per-tile features
+
+    Heights are in the [0, 1) range and the minitile flags are averaged over the tile.
+    `kind` numbers the groups that have non-empty tiles densely from 1 (0 is reserved
+    for empty tiles), `variant` is the offset within the group plus 1 for terrain and 0
+    for doodads and empty tiles.
+
+    Unlike the kinds in the feature engineering notebook, groups are not merged across
+    elevations (e.g. High Dirt transitions into Dirt ones), since that needs hand-made
+    megagroup mappings per tileset, and identical tiles are not deduplicated (see
+    `TilesetData.vocabulary` for that).
+    """
+    tile_count = len(tileset)
+    heights = tileset.height.reshape(tile_count, 16) / 4
+
+    is_doodad = tileset.is_doodad[tileset.group_id]
+    is_empty = tileset.is_empty.astype(bool)
+
+    used_groups = np.unique(tileset.group_id[~is_empty])
+    kinds = np.zeros(len(tileset.megagroup), dtype=np.float32)
+    kinds[used_groups] = np.arange(1, len(used_groups) + 1)
+    kind = np.where(is_empty, 0, kinds[tileset.group_id])
+    variant = np.where(is_empty | is_doodad, 0, tileset.group_offset.astype(np.float32) + 1)
+
+    return np.stack([
+        heights.mean(axis=1),
+        heights.min(axis=1),
+        tileset.walkable.reshape(tile_count, 16).mean(axis=1),
+        tileset.ramp.reshape(tile_count, 16).mean(axis=1),
+        tileset.blocks_view.reshape(tile_count, 16).mean(axis=1),
+        tileset.buildable,
+        kind,
+        variant,
+        is_doodad,
+    ], axis=1).astype(np.float32)
+
+def feature_map(tileset, tile_indices):
+    """Returns the [height, width, len(FEATURE_NAMES)] feature map of a tile index grid"""
+    return feature_table(tileset)[tile_indices]
+
+def height_raster(tileset, tile_indices):
+    """Returns the minitile heights of a tile index grid at 4x resolution"""
+    return _minitile_raster(tileset.height, tile_indices).astype(np.float32) / 4
+
+def walkability_raster(tileset, tile_indices):
+    """Returns the minitile walkability of a tile index grid at 4x resolution"""
+    return _minitile_raster(tileset.walkable, tile_indices).astype(bool)
+
+def _minitile_raster(column, tile_indices):
+    rows, columns = np.shape(tile_indices)
+    minitiles = column[tile_indices]
+    return minitiles.transpose([0, 2, 1, 3]).reshape([rows * 4, columns * 4])
+
+TOP = -1, 0
+LEFT = 0, -1
+
+def shift(grids, offset, fill=0):
+    """Returns the neighbour at `offset` (a (row, column) delta) of every cell
+
+    `grids` has a shape of [batch, height, width, ...]. Cells whose neighbour falls
+    outside of the grid are set to `fill`.
+    """
+    grids = np.asarray(grids)
+    result = np.full_like(grids, fill)
+    row_targets, row_sources = _shifted_slices(grids.shape[1], offset[0])
+    column_targets, column_sources = _shifted_slices(grids.shape[2], offset[1])
+    result[:, row_targets, column_targets] = grids[:, row_sources, column_sources]
+    return result
+
+def neighbour_stack(grids, offsets=(TOP, LEFT), fill=0):
+    """Gathers the neighbours at each of the stencil `offsets` for a batch of grids
+
+    Tile index grids of shape [batch, height, width] yield [batch, height, width, offsets],
+    feature maps of shape [batch, height, width, features] are concatenated along the last
+    axis into [batch, height, width, offsets * features] (e.g. top and left features).
+    """
+    grids = np.asarray(grids)
+    neighbours = [shift(grids, offset, fill) for offset in offsets]
+    if grids.ndim == 3:
+        return np.stack(neighbours, axis=-1)
+    return np.concatenate(neighbours, axis=-1)
+
+def context_pairs(grids, weights, random=np.random):
+    """Samples (tile, context tile) pairs from a batch of [batch, height, width] grids
+
+    `weights` is an odd-sized square window of distance ranks centered on each cell.
+    A radius is drawn uniformly from 1 to the largest rank for every cell, and each
+    distinct tile within the window whose rank does not exceed it becomes a context of
+    the cell. Returns two flat arrays ordered by cell.
+    """
+    grids = np.asarray(grids)
+    weights = np.asarray(weights)
+    radius = random.randint(np.max(weights), size=grids.shape) + 1
+    window_center = weights.shape[0] // 2
+    positions = np.arange(grids.size).reshape(grids.shape)
+    is_inside = np.ones(grids.shape, dtype=bool)
+
+    pair_positions = []
+    pair_contexts = []
+    for (row, column), rank in np.ndenumerate(weights):
+        if row == window_center and column == window_center:
+            continue
+
+        offset = row - window_center, column - window_center
+        mask = shift(is_inside, offset, False) & (rank <= radius)
+        pair_positions.append(positions[mask])
+        pair_contexts.append(shift(grids, offset)[mask])
+
+    pairs = np.unique(np.stack([np.concatenate(pair_positions), np.concatenate(pair_contexts)], axis=1), axis=0)
+    return grids.reshape(-1)[pairs[:, 0]], pairs[:, 1]
+
+def patches(grids, patch_size, halo):
+    """Splits a batch of [batch, height, width, ...] grids into overlapping square patches
+
+    Neighbouring patches overlap by at least `halo` rows or columns, giving the positions
+    past the halo context from above and left of the patch. Returns the patches, of shape
+    [patches * batch, patch_size, patch_size, ...], and a boolean mask of the same leading
+    shape that is set on the positions outside of the halo (the ones to compute a loss on).
+    Every grid position is unmasked in exactly one patch.
+    """
+    grids = np.asarray(grids)
+    row_ranges = _patch_ranges(grids.shape[1], patch_size, halo)
+    column_ranges = _patch_ranges(grids.shape[2], patch_size, halo)
+
+    result = []
+    masks = []
+    for row, first_row in row_ranges:
+        for column, first_column in column_ranges:
+            result.append(grids[:, row: row + patch_size, column: column + patch_size])
+            mask = np.zeros([len(grids), patch_size, patch_size], dtype=bool)
+            mask[:, first_row - row:, first_column - column:] = True
+            masks.append(mask)
+
+    return np.concatenate(result), np.concatenate(masks)
+
+def _patch_ranges(size, patch_size, halo):
+    """Returns (patch start, first position outside of the halo) pairs along an axis"""
+    if not 0 <= halo < patch_size <= size:
+        raise ValueError('Unsupported patch size %d and halo %d for size %d' % (patch_size, halo, size))
+
+    ranges = [(0, 0)]
+    while ranges[-1][0] + patch_size < size:
+        end = ranges[-1][0] + patch_size
+        ranges.append((min(end - halo, size - patch_size), end))
+    return ranges
+
+def _shifted_slices(size, delta):
+    start = min(max(-delta, 0), size)
+    stop = max(min(size - delta, size), start)
+    return slice(start, stop), slice(start + delta, stop + delta)
@@ -1,9 +1,15 @@
 import enum
+import io
 import mpq
+import multiprocessing
+import numpy
 import os
 
+from archive_cache import MemberCache, MpqHandlePool, read_member
 from tileset import *
 from scenario import *
+from scenario import ScenarioBuilder
+from scenario_cache import ScenarioCache
 from string_table import *
 
 class PlayerType(enum.Enum):
@@ -30,6 +36,8 @@ class Game:
     def __init__(self, game_directory):
         self.directory = game_directory
         self._tiles_cache = {}
+        self.errors = []
+        self.cache = None
 
         for data_file in self.data_files():
             self.load_data_file(data_file)
@@ -37,63 +45,263 @@ class Game:
     def close(self):
         self.data.close()
 
-    def process_game_scenarios(self):
+    def process_game_scenarios(self, workers=None):
         scenarios = []
-        scenarios += self.process_game_archive()
-        scenarios += self.process_directory(os.path.join(self.directory, 'Maps'))
+        scenarios += self.process_game_archive(workers)
+        scenarios += self.process_directory(os.path.join(self.directory, 'Maps'), workers)
         return scenarios
 
-    def process_game_archive(self):
-        scenarios = []
+    def process_game_archive(self, workers=None):
+        filenames = [x for x in self.scenario_filenames() if x in self.data]
+        return self.process_all(self.process_archive_file, filenames, workers, self.archive_file_cache_key)
 
-        for filename in self.scenario_filenames():
-            file = None
-            try:
-                if filename in self.data:
-                    file = self.data.open(filename)
-                    scenarios += self.process_chk(os.path.basename(filename), file)
-            finally:
-                if file != None:
-                    file.close()
+    def process_archive_file(self, filename):
+        return self.process_chk(os.path.basename(filename), io.BytesIO(self.read_data_file(filename)))
 
-        return scenarios
+    def read_data_file(self, filename):
+        """Returns the contents of a member of the game data files"""
+        file = self.data.open(filename)
+        try:
+            return file.read()
+        finally:
+            file.close()
 
-    def process_directory(self, directory):
-        scenarios = []
+    def process_directory(self, directory, workers=None):
+        file_paths = list(self.walk_directory(directory))
+        return self.process_all(self.process_file_path, file_paths, workers, self.file_path_cache_key)
 
+    def walk_directory(self, directory):
         for dir_name, subdir_list, file_list in os.walk(directory):
-            for filename in file_list:
-                file_path = os.path.join(dir_name, filename)
-                scenarios += self.process_file(filename, file_path)
+            subdir_list.sort()
+            for filename in sorted(file_list):
+                yield os.path.join(dir_name, filename)
+
+    def process_file_path(self, file_path):
+        return self.process_file(os.path.basename(file_path), file_path)
+
+    def process_file(self, filename, file_path):
+        data = self.read_scenario_file(filename, file_path)
+        if data is None:
+            return []
+
+        return self.process_chk(filename, io.BytesIO(data))
+
+    def iter_scenarios(self, sources, where=None):
+        """Lazily yields the scenarios from a list of directories and/or files
+
+        `where` is an optional predicate. It is first evaluated on a `ScenarioHeader`
+        built only from the header chunks (version, tileset, dimensions, players and
+        forces), so terrain and strings are decoded only for the matching scenarios.
+        Cached scenarios are filtered directly. Failures are recorded in `self.errors`.
+        """
+        if isinstance(sources, str):
+            sources = [sources]
+
+        try:
+            for source in sources:
+                file_paths = self.walk_directory(source) if os.path.isdir(source) else [source]
+                for file_path in file_paths:
+                    yield from self._iter_file_scenarios(file_path, where)
+        finally:
+            if self.cache != None:
+                self.cache.save()
+
+    def _iter_file_scenarios(self, file_path, where):
+        key = None
+        if self.cache != None:
+            key = self.file_path_cache_key(file_path)
+            hit = self.cache.get(*key)
+            if hit != None:
+                scenarios, messages = hit
+                self.errors += [(file_path, ScenarioError(message)) for message in messages]
+                for scenario in scenarios:
+                    scenario.game = self
+                    if where is None or where(scenario):
+                        yield scenario
+                return
+
+        filename = os.path.basename(file_path)
+        try:
+            data = self.read_scenario_file(filename, file_path)
+            if data is None:
+                return
+            if where != None:
+                header_builder = self.scenario_buider(filename, io.BytesIO(data), ScenarioBuilder.HEADER_CHUNKS)
+                if not where(header_builder.to_header()):
+                    return
+        except Exception as e:
+            self.errors.append((file_path, e))
+            return
+
+        error_count = len(self.errors)
+        scenarios = self.process_chk(filename, io.BytesIO(data))
+        self.errors[error_count:] = [(file_path, e) for _, e in self.errors[error_count:]]
+        if key != None:
+            self.cache.put(*key, scenarios, [str(e) for _, e in self.errors[error_count:]])
+        yield from scenarios
+
+    def use_cache(self, cache_directory):
+        """Enables a persistent scenario cache (see `ScenarioCache`) in the given directory"""
+        self.cache = ScenarioCache(cache_directory)
+
+    def archive_file_cache_key(self, filename):
+        # Members are fingerprinted by the data files they can come from, so that they do
+        # not have to be read (and then read again by a worker) just to look them up
+        identity = ('archive', os.path.abspath(self.directory), filename)
+        data_file_paths = (os.path.join(self.directory, x) for x in self.data_files())
+        return identity, tuple(ScenarioCache.file_fingerprint(x) for x in data_file_paths)
+
+    def file_path_cache_key(self, file_path):
+        identity = ('file', os.path.abspath(file_path))
+        return identity, ScenarioCache.file_fingerprint(file_path)
+
+    def process_all(self, method, items, workers=None, cache_key=None):
+        """Applies a bound `process_*` method to all items and concatenates the scenarios
+
+        With `workers` set, the items are spread over a pool of processes. Each of them
+        opens the game data files once and keeps its own tileset cache. Results are
+        returned in the order of `items` either way. Files that fail to parse are
+        recorded in `self.errors` as (item, exception) tuples.
+
+        If a cache is in use and `cache_key` maps an item to its (identity, fingerprint),
+        items with a matching cache entry are loaded from it instead of being parsed.
+        """
+        items = list(items)
+        keys = [None] * len(items)
+        cached = {}
+        if self.cache != None and cache_key != None:
+            for i, item in enumerate(items):
+                try:
+                    keys[i] = cache_key(item)
+                except Exception:
+                    continue
+
+                hit = self.cache.get(*keys[i])
+                if hit != None:
+                    cached[i] = hit
+
+        misses = [item for i, item in enumerate(items) if i not in cached]
+
+        pool = None
+        if workers is None:
+            results = (self._process_safely(method.__name__, item) for item in misses)
+        else:
+            pool = multiprocessing.Pool(workers, _initialize_worker, (self.directory,))
+            tasks = ((method.__name__, item) for item in misses)
+            results = pool.imap(_process_in_worker, tasks, chunksize=8)
+
+        try:
+            scenarios = []
+            for i, item in enumerate(items):
+                if i in cached:
+                    item_scenarios, messages = cached[i]
+                    item_errors = [(item, ScenarioError(message)) for message in messages]
+                else:
+                    item_scenarios, item_errors = next(results)
+                    if keys[i] != None:
+                        self.cache.put(*keys[i], item_scenarios, [str(e) for _, e in item_errors])
+
+                for scenario in item_scenarios:
+                    scenario.game = self
+                scenarios += item_scenarios
+                self.errors += item_errors
+
+            if self.cache != None:
+                self.cache.save()
+        except BaseException:
+            # Do not wait for the remaining items to be parsed
+            if pool != None:
+                pool.terminate()
+                pool.join()
+            raise
+
+        if pool != None:
+            pool.close()
+            pool.join()
 
         return scenarios
 
+    def _process_safely(self, method_name, item):
+        error_count = len(self.errors)
+        try:
+            scenarios = getattr(self, method_name)(item)
+        except Exception as e:
+            scenarios = []
+            self.errors.append((item, e))
+
+        errors = [(item, e) for _, e in self.errors[error_count:]]
+        del self.errors[error_count:]
+        return scenarios, errors
+
     def process_chk(self, filename, chk_file):
         try:
             return [self.scenario_buider(filename, chk_file).to_scenario()]
         except Exception as e:
+            self.errors.append((filename, e))
             return []
 
     def process_tileset_file(self, tileset, entry_type):
-        file = None
-        try:
-            file = self.data.open(self.tileset_basename(tileset) + '.' + entry_type.EXTENSION)
+        """Decodes a whole tileset file into a record array of `entry_type.DTYPE` entries
 
-            entries = []
-            while file.tell() != file.size():
-                data = file.read(entry_type.SIZE)
-                entry = entry_type(data)
-                entries.append(entry)
+        Fields are accessible both in bulk (e.g. `entries['megatiles']`) and per entry
+        (e.g. `entries[i]['megatiles']`). A trailing partial entry is ignored.
+        """
+        data = self.read_data_file(self.tileset_basename(tileset) + '.' + entry_type.EXTENSION)
+        entry_count = len(data) // entry_type.DTYPE.itemsize
 
-            return entries
-        finally:
-            if file != None:
-                file.close()
+        return numpy.frombuffer(data, dtype=entry_type.DTYPE, count=entry_count).view(numpy.recarray)
+
+_worker_game = None
+
+def _initialize_worker(game_directory):
+    global _worker_game
+    _worker_game = Game(game_directory)
+
+def _process_in_worker(task):
+    method_name, item = task
+    return _worker_game._process_safely(method_name, item)
 
 class MpqBasedGame(Game):
-    def __init__(self, game_directory):
+    """Implements a game with MPQ data files
+
+    Members of the data files (e.g. tilesets) are read through a `MpqHandlePool` of handles
+    of all data files and kept decompressed in a `MemberCache`. Scenario archives are read
+    only once, so they are opened and closed right away instead, and are not cached.
+    """
+
+    def __init__(self, game_directory, member_cache_budget=256 * 2 ** 20, data_handles=4):
         self.data = mpq.MPQFile()
+        self.member_cache = MemberCache(member_cache_budget)
+        self.data_handles = MpqHandlePool(self.open_data_files, data_handles)
         super().__init__(game_directory)
 
+    def close(self):
+        self.data_handles.close()
+        super().close()
+
     def load_data_file(self, data_file):
         self.data.add_archive(os.path.join(self.directory, data_file))
+
+    def open_data_files(self):
+        handle = mpq.MPQFile()
+        for data_file in self.data_files():
+            handle.add_archive(os.path.join(self.directory, data_file))
+        return handle
+
+    def read_data_file(self, filename):
+        def load():
+            with self.data_handles.open() as handle:
+                return read_member(handle, filename)
+
+        return self.member_cache.read(('data', filename), load)
+
+    def read_archive_member(self, archive_path, member):
+        """Returns the contents of a member of an MPQ archive file (e.g. a .scx map)
+
+        The archive is closed right away, so that the file is not kept locked.
+        """
+        handle = mpq.MPQFile(archive_path)
+        try:
+            return read_member(handle, member)
+        finally:
+            handle.close()
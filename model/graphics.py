@@ -1,16 +1,57 @@
 import numpy
 
+TILE_SIZE = 32
+MINITILE_SIZE = 8
+THUMBNAIL_SCALES = 2, 4, 8, 16, 32
+
 def tile(tiles):
     array_width, array_height = tiles.shape
-    tile_graphics = tiles[0, 0].graphics
-    tile_width, tile_height, *remaining = tile_graphics.shape
-    result_width = array_width * tile_width
-    result_height = array_height * tile_height
+    tile_graphics = numpy.stack([x.graphics for x in tiles.flat])
+    _, tile_width, tile_height, *remaining = tile_graphics.shape
+
+    result = tile_graphics.reshape([array_width, array_height, tile_width, tile_height, *remaining])
+    result = result.swapaxes(1, 2)
+    return result.reshape([array_width * tile_width, array_height * tile_height, *remaining])
+
+def render(tileset, tile_indices, viewport=None, scale=1):
+    """Renders a 2-D grid of tile indices into an image
+
+    The tileset is a `tileset.TilesetData`. At full scale the pixels are gathered directly
+    from the tileset atlas; with `scale` set to one of `THUMBNAIL_SCALES` the image is
+    downscaled by that factor and assembled from pre-averaged tile thumbnails.
+
+    The optional viewport is a (top, left, height, width) rectangle in pixels of the
+    (scaled) output image. Only the tiles that intersect it are rendered.
+    """
+    tile_indices = numpy.asarray(tile_indices)
+    tile_size = TILE_SIZE // scale
+
+    if viewport is not None:
+        top, left, height, width = viewport
+        first_row, first_column = top // tile_size, left // tile_size
+        last_row = -(-(top + height) // tile_size)
+        last_column = -(-(left + width) // tile_size)
+        tile_indices = tile_indices[first_row: last_row, first_column: last_column]
+
+    rows, columns = tile_indices.shape
+    if scale == 1:
+        graphics_ids = tileset.graphics_id[tile_indices]
+        flipped = tileset.flipped[tile_indices]
+        # [rows, columns, minitile rows, minitile columns, pixel rows, pixel columns, channels]
+        pixels = tileset.atlas[graphics_ids, flipped]
+        pixels = pixels.transpose([0, 2, 4, 1, 3, 5, 6])
+    elif scale in THUMBNAIL_SCALES:
+        # [rows, columns, pixel rows, pixel columns, channels]
+        pixels = tileset.thumbnails(scale)[tile_indices]
+        pixels = pixels.transpose([0, 2, 1, 3, 4])
+    else:
+        raise ValueError('Unsupported scale: %r' % scale)
 
-    result = numpy.zeros([result_width, result_height, *remaining], dtype=tile_graphics.dtype)
+    result = pixels.reshape([rows * tile_size, columns * tile_size, -1])
 
-    for x in range(0, result_width, tile_width):
-        for y in range(0, result_height, tile_height):
-            result[x:x+tile_width, y:y+tile_height] = tiles[x // tile_width, y // tile_height].graphics
+    if viewport is not None:
+        top -= first_row * tile_size
+        left -= first_column * tile_size
+        result = result[top: top + height, left: left + width]
 
     return result
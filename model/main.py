@@ -6,8 +6,11 @@ from game import Game
 if __name__ == '__main__':
     scenarios = []
     game = Game(config.STARCRAFT_ROOT)
-    scenarios += game.process_game_scenarios()
+    game.use_cache(config.SCENARIO_CACHE_DIRECTORY)
+    scenarios += game.process_game_scenarios(workers=os.cpu_count())
     for directory in config.MAP_DIRECTORIES:
-        scenarios += game.process_directory(directory)
+        scenarios += game.process_directory(directory, workers=os.cpu_count())
 
     print(len(scenarios))
+    for item, error in game.errors:
+        print('Could not process "%s": %s' % (item, error))
@@ -1,3 +1,4 @@
+import numpy as np
 import tensorflow as tf
 from tensorflow.contrib.rnn import RNNCell, LSTMStateTuple
 from tensorflow.contrib.rnn.python.ops.core_rnn_cell import _linear
@@ -21,16 +22,42 @@ def ln(tensor, scope=None, epsilon=1e-5):
     return ln_initial * scale + shift
 
 
+def grouped_ln(tensor, scopes, epsilon=1e-5):
+    """ Layer normalizes a 3D tensor of shape [batch, len(scopes), units] along its last axis
+
+    Each group uses the same variables as `ln` with the respective scope, while the
+    statistics of all groups are computed with a single moments op.
+    """
+    assert (len(tensor.get_shape()) == 3)
+    m, v = tf.nn.moments(tensor, [2], keep_dims=True)
+    scales = []
+    shifts = []
+    for scope in scopes:
+        with tf.variable_scope(scope + 'layer_norm', reuse=tf.AUTO_REUSE):
+            scales.append(tf.get_variable('scale',
+                                          shape=[tensor.get_shape()[2]],
+                                          initializer=tf.constant_initializer(1)))
+            shifts.append(tf.get_variable('shift',
+                                          shape=[tensor.get_shape()[2]],
+                                          initializer=tf.constant_initializer(0)))
+    ln_initial = (tensor - m) / tf.sqrt(v + epsilon)
+
+    return ln_initial * tf.stack(scales) + tf.stack(shifts)
+
+
 class MultiDimensionalLSTMCell(RNNCell):
     """
     Adapted from TF's BasicLSTMCell to use Layer Normalization.
     Note that state_is_tuple is always True.
+    With fused=True the five gates are normalized and activated as a single
+    [batch, 5, units] tensor. The variables and the results are the same.
     """
 
-    def __init__(self, num_units, forget_bias=0.0, activation=tf.nn.tanh):
+    def __init__(self, num_units, forget_bias=0.0, activation=tf.nn.tanh, fused=False):
         self._num_units = num_units
         self._forget_bias = forget_bias
         self._activation = activation
+        self._fused = fused
 
     @property
     def state_size(self):
@@ -51,6 +78,9 @@ class MultiDimensionalLSTMCell(RNNCell):
             # change bias argument to False since LN will add bias via shift
             concat = _linear([inputs, h1, h2], 5 * self._num_units, False)
 
+            if self._fused:
+                return self._fused_gates(concat, c1, c2)
+
             i, j, f1, f2, o = tf.split(value=concat, num_or_size_splits=5, axis=1)
 
             # add layer normalization to each gate
@@ -70,12 +100,47 @@ class MultiDimensionalLSTMCell(RNNCell):
 
             return new_h, new_state
 
+    def _fused_gates(self, concat, c1, c2):
+        gates = tf.reshape(concat, [-1, 5, self._num_units])
+        gates = grouped_ln(gates, ['i/', 'j/', 'f1/', 'f2/', 'o/'])
+
+        # sigmoid of all gates at once, with the forget bias added to f1 and f2
+        # (the sigmoid of j is computed but unused)
+        bias = np.array([0, 0, self._forget_bias, self._forget_bias, 0]).reshape([5, 1])
+        sigmoids = tf.nn.sigmoid(gates + tf.constant(bias, dtype=gates.dtype))
+        i, _, f1, f2, o = tf.unstack(sigmoids, axis=1)
+
+        new_c = c1 * f1 + c2 * f2 + i * self._activation(gates[:, 1])
+
+        new_h = self._activation(ln(new_c, scope='new_h/')) * o
+        new_state = LSTMStateTuple(new_c, new_h)
+
+        return new_h, new_state
+
 
 class MdRnnWhileLoop:
-    def __init__(self, dtype):
+    def __init__(self, dtype, wavefront=False, return_states=False, fused=False, legacy_upper_state=False):
+        """
+        @param dtype: the dtype of the states and outputs
+        @param wavefront: process a whole anti-diagonal of the grid per loop step
+            (h+w-1 steps instead of h*w). The outputs are the same as those of the
+            sequential cell-by-cell loop.
+        @param return_states: keep the states of every grid position and return them.
+            Otherwise only the previous row (or diagonal) of states is kept alive and
+            None is returned in their place.
+        @param fused: use the fused gate layer normalization of `MultiDimensionalLSTMCell`
+        @param legacy_upper_state: use the zero state as the upper neighbour of the first
+            position of the second row, as the sequential loop used to. Only meant for
+            models trained that way, and not supported in wavefront mode.
+        """
+        assert not (wavefront and legacy_upper_state)
         self.dtype = dtype
+        self.wavefront = wavefront
+        self.return_states = return_states
+        self.fused = fused
+        self.legacy_upper_state = legacy_upper_state
 
-    def __call__(self, rnn_size, input_data, dims=None, scope_n="layer1"):
+    def __call__(self, rnn_size, input_data, dims=None, scope_n="layer1", boundary_states=None):
         """Implements naive multi dimension recurrent neural networks
 
         @param rnn_size: the hidden units
@@ -83,14 +148,21 @@ class MdRnnWhileLoop:
         @param dims: dimensions to reverse the input data,eg.
             dims=[False,True,True,False] => true means reverse dimension
         @param scope_n : the scope
-
-        returns [batch,h,w,rnn_size] the output of the lstm
+        @param boundary_states: a (top, left) tuple of LSTMStateTuples of shape
+            [w,batch,rnn_size] and [h,batch,rnn_size] - the states of the row above and
+            the column left of the grid (in the order of processing, i.e. after reversal).
+            Zero states are used when not given. Only supported in wavefront mode, which
+            also sets `last_boundary_states` to the (bottom row, right column) states.
+
+        returns [batch,h,w,rnn_size] the output of the lstm and the states
+            [h*w+1,2,batch,rnn_size] (None unless `return_states` is set)
         """
 
         with tf.variable_scope("MultiDimensionalLSTMCell-" + scope_n, reuse=tf.AUTO_REUSE):
 
             # Create multidimensional cell with selected size
-            self.cell = MultiDimensionalLSTMCell(rnn_size)
+            self.cell = MultiDimensionalLSTMCell(rnn_size, fused=self.fused)
+            self.rnn_size = rnn_size
 
             # Get the shape of the input (batch_size, x, y, features)
             batch_size, self.h, self.w, features = input_data.shape.as_list()
@@ -108,35 +180,14 @@ class MdRnnWhileLoop:
 
             # Reorder inputs to (h, w, batch_size, features)
             x = tf.transpose(x, [1, 2, 0, 3])
-            # Reshape to a one dimensional tensor of (h*w*batch_size , features)
-            x = tf.reshape(x, [-1, features])
-            # Split tensor into h*w tensors of size (batch_size , features)
-            x = tf.split(axis=0, num_or_size_splits=self.h * self.w, value=x)
-
-            # Create an input tensor array (literally an array of tensors) to use inside the loop
-            inputs_ta = tf.TensorArray(dtype=self.dtype, size=self.h * self.w, name='input_ta')
-            # Unstack the input X in the tensor array
-            self.inputs_ta = inputs_ta.unstack(x)
-            # Create an input tensor array for the states
-            states_ta = tf.TensorArray(dtype=self.dtype, size=self.h * self.w + 1, name='state_ta', clear_after_read=False)
-            # And an other for the output
-            outputs_ta = tf.TensorArray(dtype=self.dtype, size=self.h * self.w, name='output_ta')
-
-            # initial cell hidden states
-            # Write to the last position of the array, the LSTMStateTuple filled with zeros
-            states_ta = states_ta.write(self.h * self.w, LSTMStateTuple(tf.zeros([batch_size_runtime, rnn_size], self.dtype),
-                                                              tf.zeros([batch_size_runtime, rnn_size], self.dtype)))
-
-            # Controls the initial index
-            time = tf.constant(0)
-
-            # Run the looped operation
-            result, outputs_ta, states_ta = tf.while_loop(self.condition, self.body, [time, outputs_ta, states_ta],
-                                                          parallel_iterations=1)
-
-            # Extract the output tensors from the processesed tensor array
-            outputs = outputs_ta.stack()
-            states = states_ta.stack()
+
+            assert boundary_states is None or self.wavefront
+            if self.wavefront:
+                outputs, states = self.wavefront_loop(x, batch_size_runtime, features, boundary_states)
+            elif self.return_states:
+                outputs, states = self.sequential_loop(x, batch_size_runtime, features)
+            else:
+                outputs, states = self.rolling_loop(x, batch_size_runtime, features), None
 
             # Reshape outputs to match the shape of the input
             y = tf.reshape(outputs, [self.h, self.w, batch_size_runtime, rnn_size])
@@ -150,12 +201,179 @@ class MdRnnWhileLoop:
             # Return the output and the inner states
             return y, states
 
+    def zero_state(self, batch_size_runtime):
+        return LSTMStateTuple(tf.zeros([batch_size_runtime, self.rnn_size], self.dtype),
+                              tf.zeros([batch_size_runtime, self.rnn_size], self.dtype))
+
+    def sequential_loop(self, x, batch_size_runtime, features):
+        """Applies the cell to one grid position per loop step, in row-major order
+
+        @param x: the input of shape [h,w,batch,features]
+
+        returns the outputs [h*w,batch,rnn_size] and the states [h*w+1,2,batch,rnn_size]
+        (the last of which is the zero state)
+        """
+        # Reshape to a one dimensional tensor of (h*w*batch_size , features)
+        x = tf.reshape(x, [-1, features])
+        # Split tensor into h*w tensors of size (batch_size , features)
+        x = tf.split(axis=0, num_or_size_splits=self.h * self.w, value=x)
+
+        # Create an input tensor array (literally an array of tensors) to use inside the loop
+        inputs_ta = tf.TensorArray(dtype=self.dtype, size=self.h * self.w, name='input_ta')
+        # Unstack the input X in the tensor array
+        self.inputs_ta = inputs_ta.unstack(x)
+        # Create an input tensor array for the states
+        states_ta = tf.TensorArray(dtype=self.dtype, size=self.h * self.w + 1, name='state_ta', clear_after_read=False)
+        # And an other for the output
+        outputs_ta = tf.TensorArray(dtype=self.dtype, size=self.h * self.w, name='output_ta')
+
+        # initial cell hidden states
+        # Write to the last position of the array, the LSTMStateTuple filled with zeros
+        states_ta = states_ta.write(self.h * self.w, self.zero_state(batch_size_runtime))
+
+        # Controls the initial index
+        time = tf.constant(0)
+
+        # Run the looped operation
+        result, outputs_ta, states_ta = tf.while_loop(self.condition, self.body, [time, outputs_ta, states_ta],
+                                                      parallel_iterations=1)
+
+        # Extract the output tensors from the processesed tensor array
+        return outputs_ta.stack(), states_ta.stack()
+
+    def rolling_loop(self, x, batch_size_runtime, features):
+        """Applies the cell in the same order as `sequential_loop` without keeping every state
+
+        Every state is written to a tensor array that releases it on its first read, which
+        happens w positions later, when it is the upper neighbour. The left neighbour is
+        carried along as a loop variable. So each step does a constant amount of work and
+        instead of O(h*w) states only O(w) are alive at a time.
+
+        returns the outputs [h*w,batch,rnn_size]
+        """
+        x = tf.reshape(x, [self.h * self.w, -1, features])
+
+        inputs_ta = tf.TensorArray(dtype=self.dtype, size=self.h * self.w, name='input_ta')
+        self.inputs_ta = inputs_ta.unstack(x)
+        outputs_ta = tf.TensorArray(dtype=self.dtype, size=self.h * self.w, name='output_ta')
+        states_ta = tf.TensorArray(dtype=self.dtype, size=self.h * self.w, name='state_ta', clear_after_read=True)
+
+        c, h = self.zero_state(batch_size_runtime)
+
+        time = tf.constant(0)
+        _, outputs_ta, _, _, _ = tf.while_loop(
+            lambda time_, *_: tf.less(time_, tf.constant(self.h * self.w)),
+            self.rolling_body,
+            [time, outputs_ta, states_ta, c, h],
+            parallel_iterations=1)
+
+        return outputs_ta.stack()
+
+    def wavefront_loop(self, x, batch_size_runtime, features, boundary_states=None):
+        """Applies the cell to a whole anti-diagonal of the grid per loop step
+
+        The cells on diagonal d (i.e. i + j == d) only depend on the cells of diagonal d-1,
+        so the grid is skewed (row i is shifted right by i) into h+w-1 columns and each
+        step feeds a full column through the cell as a batch of h*batch rows. States of the
+        positions that fall outside the grid are masked to zero, which makes them act as the
+        zero state of the grid borders, unless boundary states are given.
+
+        @param x: the input of shape [h,w,batch,features]
+        @param boundary_states: see `__call__`
+
+        returns the same outputs and states as `sequential_loop`
+        """
+        steps = self.h + self.w - 1
+
+        # Skew to (steps, h*batch_size, features)
+        x = tf.transpose(self.skew(x), [1, 0, 2, 3])
+        x = tf.reshape(x, [steps, -1, features])
+
+        inputs_ta = tf.TensorArray(dtype=self.dtype, size=steps, name='input_ta')
+        self.inputs_ta = inputs_ta.unstack(x)
+        # Unused unless the states are returned
+        states_ta = tf.TensorArray(dtype=self.dtype, size=steps, name='state_ta')
+        outputs_ta = tf.TensorArray(dtype=self.dtype, size=steps, name='output_ta')
+        # The states of the last row and the last column, by diagonal
+        bottom_ta = tf.TensorArray(dtype=self.dtype, size=steps, name='bottom_ta')
+        right_ta = tf.TensorArray(dtype=self.dtype, size=steps, name='right_ta')
+
+        if boundary_states is None:
+            boundary_states = (
+                LSTMStateTuple(*[tf.zeros([self.w, batch_size_runtime, self.rnn_size], self.dtype)] * 2),
+                LSTMStateTuple(*[tf.zeros([self.h, batch_size_runtime, self.rnn_size], self.dtype)] * 2))
+        top, left = boundary_states
+        # The upper neighbour of the first row, by diagonal
+        self.top = [tf.pad(state, [[0, self.h - 1], [0, 0], [0, 0]]) for state in top]
+        self.left = left
+
+        # valid[d, i] is set when the cell at (i, d - i) lies within the grid
+        diagonals = np.arange(steps).reshape([steps, 1]) - np.arange(self.h).reshape([1, self.h])
+        valid = (diagonals >= 0) & (diagonals < self.w)
+        self.valid = tf.constant(valid.reshape([steps, self.h, 1, 1]), dtype=self.dtype)
+
+        # The state of the previous diagonal, by grid row. Before the first diagonal that
+        # is only the left neighbour of the first position.
+        first_row = tf.constant(np.eye(1, self.h).reshape([self.h, 1, 1]), dtype=self.dtype)
+        c = left[0] * first_row
+        h = left[1] * first_row
+
+        step = tf.constant(0)
+        _, outputs_ta, states_ta, bottom_ta, right_ta, _, _ = tf.while_loop(
+            lambda step_, *_: tf.less(step_, tf.constant(steps)),
+            self.wavefront_body,
+            [step, outputs_ta, states_ta, bottom_ta, right_ta, c, h])
+
+        bottom = bottom_ta.stack()[self.h - 1:]
+        right = right_ta.stack()[self.w - 1:]
+        self.last_boundary_states = (
+            LSTMStateTuple(bottom[:, 0], bottom[:, 1]),
+            LSTMStateTuple(right[:, 0], right[:, 1]))
+
+        # Unskew back to (h*w, batch_size, rnn_size)
+        outputs = tf.reshape(outputs_ta.stack(), [steps, self.h, batch_size_runtime, self.rnn_size])
+        outputs = self.unskew(tf.transpose(outputs, [1, 0, 2, 3]))
+        outputs = tf.reshape(outputs, [self.h * self.w, batch_size_runtime, self.rnn_size])
+
+        if not self.return_states:
+            return outputs, None
+
+        # Unskew to (h*w, 2, batch_size, rnn_size) and append the zero state
+        states = tf.reshape(states_ta.stack(), [steps, 2, self.h, batch_size_runtime, self.rnn_size])
+        states = self.unskew(tf.transpose(states, [2, 0, 1, 3, 4]))
+        states = tf.reshape(states, [self.h * self.w, 2, batch_size_runtime, self.rnn_size])
+        states = tf.concat([states, tf.expand_dims(tf.stack(self.zero_state(batch_size_runtime)), 0)], 0)
+
+        return outputs, states
+
+    def skew(self, x):
+        """Shifts row i of a [h,w,...] tensor right by i, padding it to [h,h+w-1,...]"""
+        rest = tf.shape(x)[2:]
+        padding = [[0, 0], [0, self.h]] + [[0, 0]] * (len(x.shape) - 2)
+        x = tf.reshape(tf.pad(x, padding), tf.concat([[self.h * (self.h + self.w)], rest], 0))
+        x = x[:self.h * (self.h + self.w - 1)]
+        return tf.reshape(x, tf.concat([[self.h, self.h + self.w - 1], rest], 0))
+
+    def unskew(self, x):
+        """Inverts `skew`, returning a [h,w,...] tensor"""
+        rest = tf.shape(x)[2:]
+        padding = [[0, self.h]] + [[0, 0]] * (len(x.shape) - 2)
+        x = tf.reshape(x, tf.concat([[self.h * (self.h + self.w - 1)], rest], 0))
+        x = tf.reshape(tf.pad(x, padding), tf.concat([[self.h, self.h + self.w], rest], 0))
+        return x[:, :self.w]
+
     def condition(self, time_, outputs_ta_, states_ta_):
         """Loop output condition. The index, given by the time, should be less than the
         total number of steps defined within the image
         """
         return tf.less(time_, tf.constant(self.h * self.w))
 
+    def is_first_row(self, t_):
+        """Whether the upper neighbour of the sample is the zero state"""
+        if self.legacy_upper_state:
+            return tf.less_equal(t_, tf.constant(self.w))
+        return tf.less(t_, tf.constant(self.w))
+
     def get_up(self, t_, w_):
         """Function to get the sample skipping one row"""
         return t_ - tf.constant(w_)
@@ -167,10 +385,10 @@ class MdRnnWhileLoop:
     def body(self, time_, outputs_ta_, states_ta_):
         """Body of the while loop operation that applies the MD LSTM"""
 
-        # If the current position is less or equal than the width, we are in the first row
+        # If the current position is less than the width, we are in the first row
         # and we need to read the zero state we added in row (h*w).
         # If not, get the sample located at a width distance.
-        state_up = tf.cond(tf.less_equal(time_, tf.constant(self.w)),
+        state_up = tf.cond(self.is_first_row(time_),
                            lambda: states_ta_.read(self.h * self.w),
                            lambda: states_ta_.read(self.get_up(time_, self.w)))
 
@@ -190,3 +408,133 @@ class MdRnnWhileLoop:
 
         # Return outputs and incremented time step
         return time_ + 1, outputs_ta_, states_ta_
+
+    def rolling_body(self, time_, outputs_ta_, states_ta_, c_last_, h_last_):
+        """Body of the while loop operation that applies the MD LSTM keeping a row of states"""
+
+        # The first row has the zero state as its upper neighbour
+        state_up = tf.cond(self.is_first_row(time_),
+                           lambda: tf.zeros_like(tf.stack([c_last_, h_last_])),
+                           lambda: states_ta_.read(self.get_up(time_, self.w)))
+
+        # The first position of a row has the zero state as its left neighbour
+        is_first_column = tf.equal(tf.mod(time_, tf.constant(self.w)), 0)
+        c_last = tf.cond(is_first_column, lambda: tf.zeros_like(c_last_), lambda: c_last_)
+        h_last = tf.cond(is_first_column, lambda: tf.zeros_like(h_last_), lambda: h_last_)
+
+        current_state = state_up[0], c_last, state_up[1], h_last
+        out, state = self.cell(self.inputs_ta.read(time_), current_state)
+        outputs_ta_ = outputs_ta_.write(time_, out)
+        states_ta_ = states_ta_.write(time_, state)
+
+        return time_ + 1, outputs_ta_, states_ta_, state[0], state[1]
+
+    def wavefront_body(self, step_, outputs_ta_, states_ta_, bottom_ta_, right_ta_, c_, h_):
+        """Body of the while loop operation that applies the MD LSTM to a diagonal"""
+
+        # The upper neighbour of row i is row i-1 of the previous diagonal (the top boundary
+        # for the first row), the left neighbour is row i of the previous diagonal
+        c_up = tf.concat([tf.expand_dims(tf.gather(self.top[0], step_), 0), c_[:-1]], 0)
+        h_up = tf.concat([tf.expand_dims(tf.gather(self.top[1], step_), 0), h_[:-1]], 0)
+
+        rows = [-1, self.rnn_size]
+        current_state = (tf.reshape(c_up, rows), tf.reshape(c_, rows),
+                         tf.reshape(h_up, rows), tf.reshape(h_, rows))
+        out, state = self.cell(self.inputs_ta.read(step_), current_state)
+
+        # Zero the positions outside of the grid, except for the position left of the row
+        # that starts on the next diagonal, which holds the left boundary
+        valid = tf.gather(self.valid, step_)
+        next_row = tf.reshape(tf.one_hot(step_ + 1, self.h, dtype=self.dtype), [self.h, 1, 1])
+        c = tf.reshape(state[0], [self.h, -1, self.rnn_size]) * valid + self.left[0] * next_row
+        h = tf.reshape(state[1], [self.h, -1, self.rnn_size]) * valid + self.left[1] * next_row
+
+        outputs_ta_ = outputs_ta_.write(step_, out)
+        if self.return_states:
+            states_ta_ = states_ta_.write(step_, LSTMStateTuple(tf.reshape(c, rows), tf.reshape(h, rows)))
+
+        # The last row is on this diagonal from step h-1 on, the last column from step w-1 on
+        right_row = tf.clip_by_value(step_ - (self.w - 1), 0, self.h - 1)
+        bottom_ta_ = bottom_ta_.write(step_, LSTMStateTuple(c[-1], h[-1]))
+        right_ta_ = right_ta_.write(step_, LSTMStateTuple(tf.gather(c, right_row), tf.gather(h, right_row)))
+
+        return step_ + 1, outputs_ta_, states_ta_, bottom_ta_, right_ta_, c, h
+
+
+class MdRnnPatchLoop:
+    """Applies the MD LSTM to maps of any size with a graph built for fixed-size patches
+
+    Maps are split into patch_size x patch_size patches that are processed in order of
+    their anti-diagonals. The states of the last row and column of every patch are fed as
+    the boundary states of the patches below and right of it, so the stitched outputs are
+    the same as those of processing the whole map at once. All patches on an anti-diagonal
+    are independent of each other and get processed as a single batch.
+    """
+
+    def __init__(self, dtype, rnn_size, patch_size, features, scope_n="layer1", fused=False):
+        self.dtype = dtype
+        self.rnn_size = rnn_size
+        self.patch_size = patch_size
+
+        self.input_data = tf.placeholder(dtype, [None, patch_size, patch_size, features])
+        self.boundary_states = tuple(
+            LSTMStateTuple(*[tf.placeholder(dtype, [patch_size, None, rnn_size]) for _ in range(2)])
+            for _ in range(2))
+
+        loop = MdRnnWhileLoop(dtype, wavefront=True, fused=fused)
+        self.outputs, _ = loop(rnn_size, self.input_data, scope_n=scope_n, boundary_states=self.boundary_states)
+        self.last_boundary_states = loop.last_boundary_states
+
+    def run(self, session, input_data, dims=None):
+        """Runs the MD LSTM over whole maps patch by patch
+
+        @param session: the session to run the patch graph in
+        @param input_data: maps of shape [batch,h,w,features] for any h and w
+        @param dims: dimensions to reverse, as in `MdRnnWhileLoop`
+
+        returns the [batch,h,w,rnn_size] outputs
+        """
+        input_data = np.asarray(input_data)
+        if dims is not None:
+            assert dims[0] is False and dims[3] is False
+            input_data = np.flip(input_data, tuple(i for i, x in enumerate(dims) if x))
+
+        batch_size, h, w, _ = input_data.shape
+        size = self.patch_size
+        rows, columns = -(-h // size), -(-w // size)
+
+        # Positions past the bottom and right edges do not affect the ones before them
+        input_data = np.pad(input_data, [[0, 0], [0, rows * size - h], [0, columns * size - w], [0, 0]])
+        outputs = np.zeros([batch_size, rows * size, columns * size, self.rnn_size], self.dtype.as_numpy_dtype)
+        zero_state = LSTMStateTuple(*[np.zeros([size, batch_size, self.rnn_size], self.dtype.as_numpy_dtype)] * 2)
+
+        # The bottom row and right column states of the processed patches, by patch position
+        bottom_states = {}
+        right_states = {}
+
+        for diagonal in range(rows + columns - 1):
+            first_row = max(0, diagonal - columns + 1)
+            patches = [(row, diagonal - row) for row in range(first_row, min(rows, diagonal + 1))]
+
+            feed_dict = {self.input_data: np.concatenate([
+                input_data[:, row * size: (row + 1) * size, column * size: (column + 1) * size]
+                for row, column in patches])}
+            top = [bottom_states.pop((row - 1, column), zero_state) for row, column in patches]
+            left = [right_states.pop((row, column - 1), zero_state) for row, column in patches]
+            for placeholders, states in zip(self.boundary_states, (top, left)):
+                for placeholder, state in zip(placeholders, zip(*states)):
+                    feed_dict[placeholder] = np.concatenate(state, axis=1)
+
+            patch_outputs, (bottom, right) = session.run((self.outputs, self.last_boundary_states), feed_dict)
+
+            for n, (row, column) in enumerate(patches):
+                batch = slice(n * batch_size, (n + 1) * batch_size)
+                outputs[:, row * size: (row + 1) * size, column * size: (column + 1) * size] = patch_outputs[batch]
+                bottom_states[row, column] = LSTMStateTuple(bottom[0][:, batch], bottom[1][:, batch])
+                right_states[row, column] = LSTMStateTuple(right[0][:, batch], right[1][:, batch])
+
+        outputs = outputs[:, :h, :w]
+        if dims is not None:
+            outputs = np.flip(outputs, tuple(i for i, x in enumerate(dims) if x))
+
+        return outputs
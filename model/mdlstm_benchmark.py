@@ -0,0 +1,108 @@
+import numpy as np
+import tensorflow as tf
+import time
+
+from mdlstm import MdRnnWhileLoop, MultiDimensionalLSTMCell
+
+SIZES = 64, 128, 256
+
+def time_run(session, fetches, feed_dict, repeats):
+    session.run(fetches, feed_dict) # warm-up
+    start = time.perf_counter()
+    for _ in range(repeats):
+        result = session.run(fetches, feed_dict)
+    return result, (time.perf_counter() - start) / repeats
+
+def peak_memory(session, fetches, feed_dict):
+    """Returns the peak number of bytes allocated by any allocator during a run"""
+    run_metadata = tf.RunMetadata()
+    session.run(fetches, feed_dict, tf.RunOptions(trace_level=tf.RunOptions.FULL_TRACE), run_metadata)
+    return max(
+        (memory.peak_bytes for device in run_metadata.step_stats.dev_stats
+            for node in device.node_stats for memory in node.memory),
+        default=0)
+
+def benchmark_wavefront(size, batch_size=4, features=8, rnn_size=16, repeats=3):
+    """Compares the sequential and the wavefront loop on a size x size map
+
+    Both loops share their variables, so the outputs are expected to match.
+    Returns (sequential seconds, wavefront seconds, max absolute output difference).
+    """
+    tf.reset_default_graph()
+    input_data = tf.placeholder(tf.float32, [None, size, size, features])
+    sequential, _ = MdRnnWhileLoop(tf.float32)(rnn_size, input_data)
+    wavefront, _ = MdRnnWhileLoop(tf.float32, wavefront=True)(rnn_size, input_data)
+    feed_dict = {input_data: np.random.RandomState(0).rand(batch_size, size, size, features)}
+
+    with tf.Session() as session:
+        session.run(tf.global_variables_initializer())
+        sequential_result, sequential_time = time_run(session, sequential, feed_dict, repeats)
+        wavefront_result, wavefront_time = time_run(session, wavefront, feed_dict, repeats)
+
+    return sequential_time, wavefront_time, np.abs(sequential_result - wavefront_result).max()
+
+def benchmark_states(size, wavefront=False, batch_size=4, features=8, rnn_size=64, repeats=3):
+    """Compares keeping the states of every position with keeping only the last row
+
+    Returns ((full seconds, full peak bytes), (rolling seconds, rolling peak bytes)).
+    """
+    tf.reset_default_graph()
+    input_data = tf.placeholder(tf.float32, [None, size, size, features])
+    full, _ = MdRnnWhileLoop(tf.float32, wavefront, return_states=True)(rnn_size, input_data)
+    rolling, _ = MdRnnWhileLoop(tf.float32, wavefront)(rnn_size, input_data)
+    feed_dict = {input_data: np.random.RandomState(0).rand(batch_size, size, size, features)}
+
+    with tf.Session() as session:
+        session.run(tf.global_variables_initializer())
+        return tuple(
+            (time_run(session, outputs, feed_dict, repeats)[1], peak_memory(session, outputs, feed_dict))
+            for outputs in (full, rolling))
+
+def cell_op_count(fused, batch_size=4, features=8, rnn_size=16):
+    """Returns the number of graph ops a single cell invocation adds"""
+    tf.reset_default_graph()
+    inputs = tf.placeholder(tf.float32, [batch_size, features])
+    state = [tf.placeholder(tf.float32, [batch_size, rnn_size]) for _ in range(4)]
+    cell = MultiDimensionalLSTMCell(rnn_size, fused=fused)
+    cell(inputs, state) # creates the variables
+
+    op_count = len(tf.get_default_graph().get_operations())
+    cell(inputs, state)
+    return len(tf.get_default_graph().get_operations()) - op_count
+
+def benchmark_fused(size, batch_size=4, features=8, rnn_size=16, repeats=3):
+    """Compares the cell with and without fused gate normalization on a size x size map
+
+    Returns (unfused seconds, fused seconds, max absolute output difference).
+    """
+    tf.reset_default_graph()
+    input_data = tf.placeholder(tf.float32, [None, size, size, features])
+    unfused, _ = MdRnnWhileLoop(tf.float32, wavefront=True)(rnn_size, input_data)
+    fused, _ = MdRnnWhileLoop(tf.float32, wavefront=True, fused=True)(rnn_size, input_data)
+    feed_dict = {input_data: np.random.RandomState(0).rand(batch_size, size, size, features)}
+
+    with tf.Session() as session:
+        session.run(tf.global_variables_initializer())
+        unfused_result, unfused_time = time_run(session, unfused, feed_dict, repeats)
+        fused_result, fused_time = time_run(session, fused, feed_dict, repeats)
+
+    return unfused_time, fused_time, np.abs(unfused_result - fused_result).max()
+
+if __name__ == '__main__':
+    print('ops per cell: %d unfused, %d fused' % (cell_op_count(False), cell_op_count(True)))
+    for size in SIZES:
+        unfused_time, fused_time, difference = benchmark_fused(size)
+        print('%dx%d: unfused %.3fs, fused %.3fs (%.1fx), max difference %g' % (
+            size, size, unfused_time, fused_time, unfused_time / fused_time, difference))
+
+    for size in SIZES:
+        for wavefront in False, True:
+            (full_time, full_memory), (rolling_time, rolling_memory) = benchmark_states(size, wavefront)
+            print('%dx%d%s: all states %.3fs, %.1f MiB; last row %.3fs, %.1f MiB' % (
+                size, size, ' (wavefront)' if wavefront else '',
+                full_time, full_memory / 2 ** 20, rolling_time, rolling_memory / 2 ** 20))
+
+    for size in SIZES:
+        sequential_time, wavefront_time, difference = benchmark_wavefront(size)
+        print('%dx%d: sequential %.3fs, wavefront %.3fs (%.1fx), max difference %g' % (
+            size, size, sequential_time, wavefront_time, sequential_time / wavefront_time, difference))
@@ -0,0 +1,126 @@
+import functools
+import numpy as np
+import struct
+import zlib
+
+HEADER_SIZE = 32
+SECTOR_SIZE_SHIFT = 3 # 512 << 3 = 4096 bytes per sector
+
+FILE_EXISTS = 0x80000000
+FILE_COMPRESS = 0x00000200
+COMPRESSION_ZLIB = 0x02
+
+HASH_TABLE_OFFSET = 0
+HASH_NAME_A = 1
+HASH_NAME_B = 2
+HASH_FILE_KEY = 3
+
+def _crypt_table():
+    table = [0] * 0x500
+    seed = 0x00100001
+    for index1 in range(0x100):
+        index2 = index1
+        for _ in range(5):
+            seed = (seed * 125 + 3) % 0x2AAAAB
+            high = (seed & 0xFFFF) << 0x10
+            seed = (seed * 125 + 3) % 0x2AAAAB
+            table[index2] = high | (seed & 0xFFFF)
+            index2 += 0x100
+    return table
+
+CRYPT_TABLE = _crypt_table()
+
+@functools.lru_cache(maxsize=1024)
+def hash_string(string, hash_type):
+    seed1 = 0x7FED7FED
+    seed2 = 0xEEEEEEEE
+    for character in string.upper().replace('/', '\\').encode('ascii'):
+        seed1 = (CRYPT_TABLE[(hash_type << 8) + character] ^ (seed1 + seed2)) & 0xFFFFFFFF
+        seed2 = (character + seed1 + seed2 + (seed2 << 5) + 3) & 0xFFFFFFFF
+    return seed1
+
+def encrypt(values, key):
+    """Encrypts a sequence of uint32 values the way MPQ hash and block tables are"""
+    seed1 = key
+    seed2 = 0xEEEEEEEE
+    result = []
+    for value in values:
+        seed2 = (seed2 + CRYPT_TABLE[0x400 + (seed1 & 0xFF)]) & 0xFFFFFFFF
+        result.append(value ^ ((seed1 + seed2) & 0xFFFFFFFF))
+        seed1 = (((~seed1 << 0x15) + 0x11111111) | (seed1 >> 0x0B)) & 0xFFFFFFFF
+        seed2 = (value + seed2 + (seed2 << 5) + 3) & 0xFFFFFFFF
+    return np.array(result, dtype='<u4')
+
+HASH_TABLE_KEY = hash_string('(hash table)', HASH_FILE_KEY)
+BLOCK_TABLE_KEY = hash_string('(block table)', HASH_FILE_KEY)
+
+def compress_file(data):
+    """Returns the compressed form of a file: a sector offset table followed by its sectors
+
+    Every sector is zlib compressed, unless that does not make it smaller, in which case
+    it is stored as is.
+    """
+    sector_size = 512 << SECTOR_SIZE_SHIFT
+    sectors = []
+    for start in range(0, len(data), sector_size):
+        sector = bytes(data[start: start + sector_size])
+        compressed = bytes([COMPRESSION_ZLIB]) + zlib.compress(sector, 9)
+        if len(compressed) < len(sector):
+            sector = compressed
+        sectors.append(sector)
+
+    lengths = np.array([len(x) for x in sectors], dtype=np.int64)
+    offsets = 4 * (len(sectors) + 1) + np.concatenate([[0], np.cumsum(lengths)])
+    return offsets.astype('<u4').tobytes() + b''.join(sectors)
+
+def write_archive(output, files, compress=False):
+    """Writes an MPQ (format version 1) archive to a binary file object
+
+    `files` is a list of (name, data) pairs. A `(listfile)` is added so that the names
+    can be enumerated. Returns the size of the archive.
+
+    Classic StarCraft and StarEdit only read uncompressed or PKWARE imploded sectors, so
+    archives for them must be written uncompressed. zlib compression (`compress`) is only
+    understood by later Storm versions and StarCraft: Remastered.
+    """
+    files = list(files) + [('(listfile)', '\r\n'.join(name for name, _ in files).encode('ascii'))]
+
+    hash_table_size = 1
+    while hash_table_size < len(files) * 2:
+        hash_table_size *= 2
+
+    position = HEADER_SIZE
+    stored_files = []
+    block_table = []
+    for name, data in files:
+        if compress:
+            stored = compress_file(data)
+            block_table += [position, len(stored), len(data), FILE_EXISTS | FILE_COMPRESS]
+        else:
+            stored = bytes(data)
+            block_table += [position, len(stored), len(data), FILE_EXISTS]
+        stored_files.append(stored)
+        position += len(stored)
+
+    hash_table = [0xFFFFFFFF] * (hash_table_size * 4)
+    for block_index, (name, _) in enumerate(files):
+        slot = hash_string(name, HASH_TABLE_OFFSET) % hash_table_size
+        while hash_table[slot * 4 + 3] != 0xFFFFFFFF:
+            slot = (slot + 1) % hash_table_size
+        # name A, name B, locale and platform (both 0), block index
+        hash_table[slot * 4: slot * 4 + 4] = [
+            hash_string(name, HASH_NAME_A), hash_string(name, HASH_NAME_B), 0, block_index]
+
+    hash_table_offset = position
+    block_table_offset = hash_table_offset + hash_table_size * 16
+    archive_size = block_table_offset + len(files) * 16
+
+    output.write(struct.pack(
+        '<4sIIHHIIII', b'MPQ\x1a', HEADER_SIZE, archive_size, 0, SECTOR_SIZE_SHIFT,
+        hash_table_offset, block_table_offset, hash_table_size, len(files)))
+    for stored in stored_files:
+        output.write(stored)
+    output.write(encrypt(hash_table, HASH_TABLE_KEY).tobytes())
+    output.write(encrypt(block_table, BLOCK_TABLE_KEY).tobytes())
+
+    return archive_size
@@ -0,0 +1,60 @@
+import numpy as np
+
+import features
+
+class Sampler:
+    """Implements batched autoregressive sampling of tile index grids
+
+    Every tile is drawn conditioned on its top and left neighbours. Since those are on the
+    previous anti-diagonal, the grids are filled one anti-diagonal at a time, scoring the
+    cells of a whole diagonal across all grids with a single call of the model.
+
+    `score` is any callable that maps a [cells, ...] array of encoded contexts to a
+    [cells, len(classes)] array of non-negative weights (e.g. class probabilities).
+    `classes` holds the tile index of every score column and defaults to all tiles of the
+    tileset. `encode` maps the (top, left) tile index arrays of the cells to the model
+    input and defaults to the concatenated `features.feature_table` rows of both
+    neighbours. Positions outside of the grid are treated as `border_tile`.
+    """
+
+    def __init__(self, tileset, score, classes=None, encode=None, border_tile=0):
+        self.tileset = tileset
+        self.score = score
+        self.classes = np.arange(len(tileset)) if classes is None else np.asarray(classes)
+        self.encode = self.encode_features if encode is None else encode
+        self.border_tile = border_tile
+
+    def encode_features(self, top, left):
+        feature_table = features.feature_table(self.tileset)
+        return np.concatenate([feature_table[top], feature_table[left]], axis=1)
+
+    def sample(self, count, height, width, random=np.random):
+        """Returns `count` sampled [height, width] grids of tile indices
+
+        Pass a seeded `numpy.random.RandomState` as `random` for reproducible results.
+        """
+        grids = np.full([count, height + 1, width + 1], self.border_tile, dtype=np.uint16)
+
+        # Work on a grid padded with a row above and a column left of the map
+        for diagonal in range(height + width - 1):
+            rows = np.arange(max(0, diagonal - width + 1), min(height, diagonal + 1)) + 1
+            columns = diagonal + 2 - rows
+
+            top = grids[:, rows - 1, columns].reshape(-1)
+            left = grids[:, rows, columns - 1].reshape(-1)
+            weights = np.asarray(self.score(self.encode(top, left)), dtype=np.float64)
+            choices = categorical(weights, random)
+            grids[:, rows, columns] = self.classes[choices].reshape(count, len(rows))
+
+        return grids[:, 1:, 1:]
+
+def categorical(weights, random=np.random):
+    """Draws one column index per row of a [rows, columns] array of non-negative weights
+
+    Rows whose weights are all zero are sampled uniformly.
+    """
+    weights = np.where(weights.sum(axis=1, keepdims=True) > 0, weights, 1)
+    cumulative = np.cumsum(weights, axis=1)
+    thresholds = random.random_sample(len(weights)) * cumulative[:, -1]
+    choices = (cumulative <= thresholds[:, np.newaxis]).sum(axis=1)
+    return np.minimum(choices, weights.shape[1] - 1)
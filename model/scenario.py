@@ -1,6 +1,5 @@
 import enum
 import numpy as np
-import os
 import struct
 
 import graphics
@@ -22,35 +21,80 @@ class ScenarioVersion(enum.Enum):
 class ScenarioBuilder:
     MAX_PLAYER_COUNT = 8
     MAX_FORCE_COUNT = 4
+    PARTIAL_CHUNKS = frozenset([b'MTXM'])
+    HEADER_CHUNKS = frozenset(['VER', 'ERA', 'DIM', 'OWNR', 'FORC'])
 
-    def __init__(self, game, filename, chk_file):
+    def __init__(self, game, filename, chk_file, chunk_names=None):
+        """Reads all chunks of a scenario
+
+        If `chunk_names` is given, only the chunks with these names are handled
+        (e.g. `HEADER_CHUNKS` to read just enough for `to_header`).
+        """
         self.game = game
         self.filename = filename
-        while True:
-            try:
-                chunk_code = chk_file.read(4)
-                if len(chunk_code) < 4:
-                    break
-            except Exception as e:
-                raise ScenarioError('Error reading chunk in file "%s"' % filename) from e
 
-            try:
-                chunk_name = chunk_code.decode('ascii').strip()
-            except UnicodeDecodeError as e:
-                chunk_name = ''
+        try:
+            data = memoryview(chk_file.read())
+        except Exception as e:
+            raise ScenarioError('Error reading chunk in file "%s"' % filename) from e
+
+        chunk_handlers = self.chunk_handlers()
+        for chunk_code, chunk_offsets in self.chunk_directory(data).items():
+            if chunk_code not in chunk_handlers:
+                continue
+
+            chunk_name, chunk_handler = chunk_handlers[chunk_code]
+            if chunk_names is not None and chunk_name not in chunk_names:
+                continue
+
+            if chunk_code not in self.PARTIAL_CHUNKS:
+                chunk_offsets = chunk_offsets[-1:]
 
             try:
-                chunk_size = int.from_bytes(chk_file.read(4), byteorder='little', signed=True)
-                chunk_handler_name = 'handle_' + chunk_name
-                if chunk_size > 0 and hasattr(self, chunk_handler_name):
-                    chunk_handler = getattr(self, chunk_handler_name)
-                    chunk_data = chk_file.read(chunk_size)
-                    chunk_handler(chunk_data)
-                else:
-                    chk_file.seek(chunk_size, os.SEEK_CUR)
+                for offset, size in chunk_offsets:
+                    chunk_handler(self, data[offset: offset + size])
             except Exception as e:
                 raise ScenarioError('Error reading chunk "%s"' % chunk_name) from e
 
+    @classmethod
+    def chunk_handlers(cls):
+        """Returns a table of chunk code -> (chunk name, handler) built from the `handle_*` methods"""
+        if '_chunk_handlers' not in cls.__dict__:
+            cls._chunk_handlers = {}
+            for attribute in dir(cls):
+                if attribute.startswith('handle_'):
+                    chunk_name = attribute[len('handle_'):]
+                    chunk_code = chunk_name.ljust(4).encode('ascii')
+                    cls._chunk_handlers[chunk_code] = chunk_name, getattr(cls, attribute)
+
+        return cls._chunk_handlers
+
+    @staticmethod
+    def chunk_directory(data):
+        """Returns a table of chunk code -> [(offset, size)] in file order
+
+        The chunks are walked the way StarCraft does it: a negative size moves the read
+        position backwards, and reading stops at either end of the data or when a position
+        repeats. Empty chunks are skipped, truncated chunks are clamped.
+        """
+        directory = {}
+        visited_positions = set()
+        position = 0
+
+        while 0 <= position and position + 8 <= len(data) and position not in visited_positions:
+            visited_positions.add(position)
+            chunk_code = bytes(data[position: position + 4])
+            chunk_size = int.from_bytes(data[position + 4: position + 8], byteorder='little', signed=True)
+            position += 8
+
+            if chunk_size > 0:
+                size = min(chunk_size, len(data) - position)
+                directory.setdefault(chunk_code, []).append((position, size))
+
+            position += chunk_size
+
+        return directory
+
     def handle_VER(self, data):
         """Handles the version"""
         self.version = ScenarioVersion(int.from_bytes(data, byteorder='little'))
@@ -66,38 +110,103 @@ class ScenarioBuilder:
 
     def handle_DIM(self, data):
         """Handles the dimentions of the map"""
-        self.height, self.width = struct.unpack('<HH', data)
+        self.width, self.height = struct.unpack('<HH', data)
 
     def handle_MTXM(self, data):
-        """Handles the map tiles"""
-        if hasattr(self, 'mtmx_data'):
-            self.mtmx_data += data
-        else:
-            self.mtmx_data = data
+        """Handles the map tiles
+
+        Every MTXM chunk overwrites the tiles from the start of the map, so later
+        (possibly partial) chunks take precedence over earlier ones.
+        """
+        if not hasattr(self, 'mtxm_fragments'):
+            self.mtxm_fragments = []
+        self.mtxm_fragments.append(data)
 
     def process_MTMX(self):
-        tiles = struct.unpack_from('<%dH' % (self.width * self.height), self.mtmx_data)
-        tiles = [self.get_tile(tile) for tile in tiles]
-        self.tiles = np.array(tiles, dtype=object).reshape(self.width, self.height)
+        tile_count = len(self.game.tiles(self.tileset))
+        tile_indices = np.zeros(self.width * self.height, dtype=np.uint16)
+        for fragment in self.mtxm_fragments:
+            fragment_size = min(len(fragment) // 2, len(tile_indices))
+            tile_indices[: fragment_size] = np.frombuffer(fragment, dtype='<u2', count=fragment_size)
+
+        tile_indices[tile_indices >= tile_count] = 0
+        self.tile_indices = tile_indices.reshape(self.height, self.width)
         del self.width
         del self.height
-        del self.mtmx_data
+        del self.mtxm_fragments
+
+    def to_header(self):
+        return ScenarioHeader(
+            self.game, self.filename, self.version, self.tileset,
+            self.width, self.height, self.player_types, self.alliances)
 
     def xhandle_UNIT(self, data):
         """Handles the units on the map"""
         pass # TODO: extract start location and resources data
 
-    def get_tile(self, tile_index):
-        tiles = self.game.tiles(self.tileset)
-        return tiles[tile_index if tile_index < len(tiles) else 0]
+class ChunkWriter:
+    """Implements streaming CHK chunks into an output
+
+    The output is a binary file object, a bytearray (written from `position` on, growing
+    it if needed) or None, in which case nothing is written and only `position` advances
+    (e.g. to find the size of the chunks up front and preallocate a bytearray).
+    Chunk parts can be any contiguous buffers, including numpy arrays.
+    """
+
+    def __init__(self, output=None, position=0):
+        self.output = output
+        self.position = position
+
+    def write_chunk(self, chunk_code, *parts):
+        parts = [memoryview(self.to_bytes_view(x)).cast('B') for x in parts]
+        self.write(chunk_code + struct.pack('<l', sum(len(x) for x in parts)))
+        for part in parts:
+            self.write(part)
+
+    @staticmethod
+    def to_bytes_view(data):
+        if isinstance(data, np.ndarray):
+            return np.ascontiguousarray(data).reshape(-1).view(np.uint8)
+        return data
+
+    def write(self, data):
+        if isinstance(self.output, bytearray):
+            self.output[self.position: self.position + len(data)] = data
+        elif self.output != None:
+            self.output.write(data)
+        self.position += len(data)
+
+class ScenarioHeader:
+    """Implements the cheap-to-read subset of the scenario attributes
+
+    It is built from `ScenarioBuilder.HEADER_CHUNKS` only, so that scenarios can be
+    filtered before their terrain and strings are decoded.
+    """
+
+    __slots__ = [
+        'game', 'filename', 'version', 'tileset', 'width', 'height', 'player_types',
+        'human_players', 'computer_players', 'alliances',
+    ]
+
+    def __init__(self, game, filename, version, tileset, width, height, player_types, alliances):
+        self.game = game
+        self.filename = filename
+        self.version = version
+        self.tileset = tileset
+        self.width = width
+        self.height = height
+        self.player_types = player_types
+        self.human_players = self.player_types.count(game.player_type.HUMAN)
+        self.computer_players = self.player_types.count(game.player_type.COMPUTER)
+        self.alliances = alliances
 
 class Scenario:
     __slots__ = [
         'version', 'name', 'description', 'strings', 'filename', 'tileset', 'alliances',
-        'player_types', 'human_players', 'computer_players', 'tiles', 'game',
+        'player_types', 'human_players', 'computer_players', 'tile_indices', '_tiles', 'game',
     ]
 
-    def __init__(self, game, name, description, version, strings, tileset, filename, alliances, player_types, tiles):
+    def __init__(self, game, name, description, version, strings, tileset, filename, alliances, player_types, tile_indices):
         self.game = game
         self.name = name
         self.description = description
@@ -109,29 +218,52 @@ class Scenario:
         self.player_types = player_types
         self.human_players = self.player_types.count(game.player_type.HUMAN)
         self.computer_players = self.player_types.count(game.player_type.COMPUTER)
-        self.tiles = tiles
+        self.tile_indices = tile_indices
+        self._tiles = None
 
         self.__assert_attribute('name')
         self.__assert_attribute('description')
         self.__assert_attribute('player_types')
         self.__assert_attribute('alliances')
         self.__assert_attribute('tileset')
-        self.__assert_attribute('tiles')
+        self.__assert_attribute('tile_indices')
 
     def __assert_attribute(self, attribute):
         if not hasattr(self, attribute):
             raise ScenarioError('Required attribute "%s" missing in file "%s"' % (attribute, self.filename))
 
+    def __getstate__(self):
+        # The game holds open archive handles, so it is not pickled along with the scenario
+        return {x: getattr(self, x) for x in self.__slots__ if x not in ('_tiles', 'game') and hasattr(self, x)}
+
+    def __setstate__(self, state):
+        self.game = None
+        self._tiles = None
+        for attribute, value in state.items():
+            setattr(self, attribute, value)
+
+    @property
+    def tiles(self):
+        """An object array of `tileset.Tile` views, built on first access"""
+        if self._tiles is None:
+            tiles = self.game.tiles(self.tileset)
+            self._tiles = np.frompyfunc(tiles.__getitem__, 1, 1)(self.tile_indices)
+        return self._tiles
+
     @property
     def width(self):
-        return self.tiles.shape[0]
+        return self.tile_indices.shape[1]
 
     @property
     def height(self):
-        return self.tiles.shape[1]
+        return self.tile_indices.shape[0]
 
     @property
     def graphics(self):
-        return graphics.tile(self.tiles)
+        return self.render()
+
+    def render(self, viewport=None, scale=1):
+        """Renders the terrain (see `graphics.render`)"""
+        return graphics.render(self.game.tiles(self.tileset), self.tile_indices, viewport, scale)
 
-__all__ = ['ScenarioError', 'ScenarioVersion', 'Scenario']
+__all__ = ['ScenarioError', 'ScenarioVersion', 'ScenarioHeader', 'Scenario']
@@ -0,0 +1,170 @@
+import glob
+import numpy as np
+import os
+import pickle
+
+class ScenarioRecord:
+    __slots__ = 'scenario_class', 'state', 'segment', 'offset', 'shape'
+
+    def __init__(self, scenario_class, state, shape):
+        self.scenario_class = scenario_class
+        self.state = state
+        self.segment = None
+        self.offset = 0
+        self.shape = shape
+
+    @property
+    def size(self):
+        return int(np.prod(self.shape)) * 2
+
+class CacheEntry:
+    __slots__ = 'fingerprint', 'records', 'errors', 'last_used'
+
+    def __init__(self, fingerprint, records, errors, last_used):
+        self.fingerprint = fingerprint
+        self.records = records
+        self.errors = errors
+        self.last_used = last_used
+
+class ScenarioCache:
+    """Implements a persistent on-disk cache of parsed scenarios
+
+    Scenario metadata is kept in a pickled index, while the terrain grids are written to
+    binary segment files that are memory-mapped when read back. Entries are keyed by an
+    identity (a file path or an archive member) and a fingerprint of the files it comes
+    from (their sizes and mtimes), so changed files get reparsed and replace their old
+    entries. Entries of deleted files, and entries not used in the last `max_unused_runs`
+    runs (e.g. of directories that are no longer scanned), are evicted on `save`.
+    """
+
+    VERSION = 2
+    INDEX_FILENAME = 'index.pickle'
+    SEGMENT_PATTERN = 'tiles-*.bin'
+
+    def __init__(self, directory, max_unused_runs=10):
+        self.directory = directory
+        self.max_unused_runs = max_unused_runs
+        os.makedirs(directory, exist_ok=True)
+
+        self.entries = {}
+        self.segment_count = 0
+        self.run = 0
+        self._segments = {}
+        self._pending = {}
+
+        try:
+            with open(os.path.join(directory, self.INDEX_FILENAME), 'rb') as index_file:
+                index = pickle.load(index_file)
+            if index['version'] == self.VERSION:
+                self.entries = index['entries']
+                self.segment_count = index['segment_count']
+                self.run = index['run'] + 1
+        except (OSError, EOFError, KeyError, pickle.UnpicklingError, AttributeError, ImportError):
+            pass
+
+        self._remove_unused_segments()
+
+    @staticmethod
+    def file_fingerprint(file_path):
+        stat = os.stat(file_path)
+        return stat.st_size, stat.st_mtime_ns
+
+    def get(self, identity, fingerprint):
+        """Returns a tuple of (scenarios, error messages) on a hit and None on a miss"""
+        entry = self.entries.get(identity)
+        if entry is None or entry.fingerprint != fingerprint:
+            return None
+
+        entry.last_used = self.run
+        return [self._load_scenario(record) for record in entry.records], entry.errors
+
+    def put(self, identity, fingerprint, scenarios, errors):
+        records = []
+        for scenario in scenarios:
+            state = scenario.__getstate__()
+            tile_indices = np.ascontiguousarray(state.pop('tile_indices'), dtype='<u2')
+            record = ScenarioRecord(type(scenario), state, tile_indices.shape)
+            self._pending[record] = tile_indices
+            records.append(record)
+
+        self.entries[identity] = CacheEntry(fingerprint, records, errors, self.run)
+
+    def save(self):
+        """Writes pending terrain grids and the index, evicting stale entries"""
+        self._write_segment(self._pending)
+        self._pending = {}
+
+        for identity, entry in list(self.entries.items()):
+            if identity[0] == 'file' and not os.path.exists(identity[1]):
+                del self.entries[identity]
+            elif self.run - entry.last_used >= self.max_unused_runs:
+                del self.entries[identity]
+
+        live_size = sum(record.size for record in self._records())
+        total_size = sum(os.path.getsize(x) for x in self._segment_paths())
+        if live_size * 2 < total_size:
+            self._write_segment({record: self._load_tiles(record) for record in self._records()})
+
+        index_path = os.path.join(self.directory, self.INDEX_FILENAME)
+        with open(index_path + '.tmp', 'wb') as index_file:
+            pickle.dump({
+                'version': self.VERSION,
+                'entries': self.entries,
+                'segment_count': self.segment_count,
+                'run': self.run,
+            }, index_file, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(index_path + '.tmp', index_path)
+
+        self._remove_unused_segments()
+
+    def _records(self):
+        return (record for entry in self.entries.values() for record in entry.records)
+
+    def _segment_paths(self):
+        return glob.glob(os.path.join(self.directory, self.SEGMENT_PATTERN))
+
+    def _write_segment(self, grids):
+        grids = {record: tile_indices for record, tile_indices in grids.items() if tile_indices.size}
+        if not grids:
+            return
+
+        segment = 'tiles-%d.bin' % self.segment_count
+        self.segment_count += 1
+
+        offset = 0
+        with open(os.path.join(self.directory, segment), 'wb') as segment_file:
+            for record, tile_indices in grids.items():
+                segment_file.write(tile_indices.tobytes())
+                record.segment = segment
+                record.offset = offset
+                offset += tile_indices.nbytes
+
+    def _remove_unused_segments(self):
+        used_segments = {record.segment for record in self._records()}
+        for segment_path in self._segment_paths():
+            segment = os.path.basename(segment_path)
+            if segment not in used_segments:
+                self._segments.pop(segment, None)
+                try:
+                    os.remove(segment_path)
+                except OSError:
+                    pass # still mapped (e.g. on Windows); retried on the next run
+
+    def _load_tiles(self, record):
+        if record in self._pending:
+            return self._pending[record]
+        if record.segment is None:
+            return np.zeros(record.shape, dtype=np.uint16)
+
+        if record.segment not in self._segments:
+            segment_path = os.path.join(self.directory, record.segment)
+            self._segments[record.segment] = np.memmap(segment_path, dtype='<u2', mode='r')
+
+        start = record.offset // 2
+        tile_indices = self._segments[record.segment][start: start + record.size // 2]
+        return tile_indices.view(np.ndarray).reshape(record.shape)
+
+    def _load_scenario(self, record):
+        scenario = record.scenario_class.__new__(record.scenario_class)
+        scenario.__setstate__(dict(record.state, tile_indices=self._load_tiles(record)))
+        return scenario
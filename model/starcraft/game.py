@@ -1,3 +1,4 @@
+import io
 import mpq
 import os
 
@@ -33,31 +34,25 @@ class Game(game.MpqBasedGame):
             'patch_ed.mpq',
         ]
 
-    def process_file(self, filename, file_path):
+    def read_scenario_file(self, filename, file_path):
         if filename.endswith('.chk'):
             with open(file_path, 'rb') as chk_file:
-                return self.process_chk(filename, chk_file)
+                return chk_file.read()
         elif filename.endswith('.scm') or filename.endswith('.scx'):
-            map = mpq.MPQFile(file_path)
-            try:
-                chk_file = map.open('staredit\\scenario.chk')
-                return self.process_chk(filename, chk_file)
-            finally:
-                chk_file.close()
+            return self.read_archive_member(file_path, 'staredit\\scenario.chk')
         else:
-            return []
+            return None
 
     def scenario_filenames(self):
-        map_data = self.data.open('arr\mapdata.tbl')
         try:
-            return [x + '\\staredit\\scenario.chk' for x in StringTable(map_data)]
+            map_data = self.read_data_file('arr\mapdata.tbl')
         except mpq.storm.error as e:
             return []
-        finally:
-            map_data.close()
 
-    def scenario_buider(self, filename, chk_file):
-        return starcraft.scenario.ScenarioBuilder(self, filename, chk_file)
+        return [x + '\\staredit\\scenario.chk' for x in StringTable(io.BytesIO(map_data))]
+
+    def scenario_buider(self, filename, chk_file, chunk_names=None):
+        return starcraft.scenario.ScenarioBuilder(self, filename, chk_file, chunk_names)
 
     def tileset_basename(self, tileset):
         return {
@@ -79,15 +74,8 @@ class Game(game.MpqBasedGame):
             vr4_entries = self.process_tileset_file(tileset, VR4Entry)
             wpe_entries = self.process_tileset_file(tileset, starcraft.tileset.WPEEntry)
 
-            minitile_graphics = [vr4_entry.to_graphics(wpe_entries) for vr4_entry in vr4_entries]
+            atlas = VR4Entry.to_atlas(vr4_entries, wpe_entries)
 
-            self._tiles_cache[tileset] = []
-            for group_id, cv5_entry in enumerate(cv5_entries):
-                tile_group = TileGroup(group_id, cv5_entry)
-                for group_offset, megatile in enumerate(cv5_entry.megatiles):
-                    vf4_entry = vf4_entries[megatile]
-                    vx4_entry = vx4_entries[megatile]
-                    tile = Tile(tile_group, group_offset, vf4_entry, vx4_entry, minitile_graphics)
-                    self._tiles_cache[tileset].append(tile)
+            self._tiles_cache[tileset] = TilesetData.from_entries(cv5_entries, vf4_entries, vx4_entries, atlas)
 
         return self._tiles_cache[tileset]
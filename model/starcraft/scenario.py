@@ -1,11 +1,19 @@
+import collections
+import concurrent.futures
+import numpy as np
+import os
 import struct
+import time
 
+import mpq_writer
 import scenario
+import starcraft.game
+from string_table import StringTable
 
 class ScenarioBuilder(scenario.ScenarioBuilder):
     def handle_FORC(self, data):
         """Handles force (alliance) information"""
-        data = data.ljust(20, b'\0')
+        data = bytes(data).ljust(20, b'\0')
         self.player_forces = struct.unpack_from('B' * self.MAX_PLAYER_COUNT, data)
         self.force_flags = struct.unpack_from('B' * self.MAX_FORCE_COUNT, data, offset=16)
 
@@ -41,28 +49,26 @@ class ScenarioBuilder(scenario.ScenarioBuilder):
         pass # TODO: extract trees and other decorations
 
     def handle_STR(self, data):
-        if len(data) < 2:
-            return
+        """Handles the string table, decoding the strings only on access"""
+        if hasattr(self, 'strings') and self.strings.extended:
+            return # the STRx chunk takes precedence
 
-        string_count = int.from_bytes(data[:2], byteorder='little')
-        offsets = struct.unpack_from('<%dH' % string_count, data, offset=2)
+        self.strings = StringTable.from_buffer(data)
 
-        self.strings = []
-        for i in range(string_count):
-            string_start = offsets[i]
-            string_end = data.find(b'\0', string_start)
-            self.strings.append(data[string_start: string_end].decode('ISO-8859-1'))
+    def handle_STRx(self, data):
+        """Handles the extended string table (32-bit count and offsets)"""
+        self.strings = StringTable.from_buffer(data, extended=True)
 
     def handle_SPRP(self, data):
         self.name_index, self.description_index = struct.unpack('<HH', data)
 
     def process_SPRP(self):
-        if hasattr(self, 'name_index') and 0 < self.name_index < len(self.strings):
+        if hasattr(self, 'name_index') and 0 < self.name_index <= len(self.strings):
             self.name = self.strings[self.name_index - 1]
         else:
             self.name = self.filename
 
-        if hasattr(self, 'description_index') and 0 < self.description_index < len(self.strings):
+        if hasattr(self, 'description_index') and 0 < self.description_index <= len(self.strings):
             self.description = self.strings[self.description_index - 1]
         else:
             self.description = 'Destroy all enemy buildings.'
@@ -70,6 +76,10 @@ class ScenarioBuilder(scenario.ScenarioBuilder):
         del self.name_index
         del self.description_index
 
+    def to_header(self):
+        self.process_FORC()
+        return super().to_header()
+
     def to_scenario(self):
         self.process_FORC()
         self.process_MTMX()
@@ -77,6 +87,52 @@ class ScenarioBuilder(scenario.ScenarioBuilder):
 
         return Scenario(**self.__dict__)
 
+UNIT_DTYPE = np.dtype([
+    ('instance', '<u4'),
+    ('x', '<u2'),
+    ('y', '<u2'),
+    ('unit_id', '<u2'),
+    ('link_type', '<u2'),
+    ('special_properties', '<u2'),
+    ('valid_properties', '<u2'),
+    ('owner', 'u1'),
+    ('hit_points', 'u1'),
+    ('shields', 'u1'),
+    ('energy', 'u1'),
+    ('resources', '<u4'),
+    ('hangar', '<u2'),
+    ('state_flags', '<u2'),
+    ('unused', '<u4'),
+    ('linked_instance', '<u4'),
+])
+
+THG2_DTYPE = np.dtype([
+    ('sprite_id', '<u2'),
+    ('x', '<u2'),
+    ('y', '<u2'),
+    ('owner', 'u1'),
+    ('unused', 'u1'),
+    ('flags', '<u2'),
+])
+
+def string_table_chunk(strings):
+    """Returns the (chunk code, header, string data) of a string table
+
+    The STR chunk is used while the offsets fit in 16 bits, the extended STRx chunk (with
+    32-bit count and offsets) otherwise.
+    """
+    encoded = [x.encode('ISO-8859-1', 'replace') + b'\0' for x in strings]
+    lengths = np.array([len(x) for x in encoded], dtype=np.int64)
+
+    for chunk_code, dtype in ((b'STR ', np.dtype('<u2')), (b'STRx', np.dtype('<u4'))):
+        header_size = dtype.itemsize * (len(strings) + 1)
+        if header_size + lengths.sum() <= np.iinfo(dtype).max:
+            break
+
+    offsets = header_size + np.cumsum(lengths) - lengths
+    header = np.concatenate([[len(strings)], offsets]).astype(dtype)
+    return chunk_code, header, b''.join(encoded)
+
 class Scenario(scenario.Scenario):
     """Implements a StarCraft scenario.
 
@@ -84,70 +140,122 @@ class Scenario(scenario.Scenario):
     http://www.staredit.net/wiki/index.php?title=Scenario.chk
     """
 
-    def to_chunk_data(self):
-        result = b''
+    def write_chunks(self, output=None, units=None, thingies=None):
+        """Writes the scenario as CHK chunks and returns their total size
 
-        result += b'TYPE'
-        result += struct.pack('<L', 4)
-        result += b'RAWB'
+        The output can be anything `scenario.ChunkWriter` accepts. `units` and `thingies`
+        are optional arrays of `UNIT_DTYPE` and `THG2_DTYPE` records.
+        """
+        writer = scenario.ChunkWriter(output)
 
-        result += b'VER '
-        result += struct.pack('<L', 2)
-        result += struct.pack('<H', ScenarioVersion.STARCRAFT_EXP.value)
+        writer.write_chunk(b'TYPE', b'RAWB')
+        writer.write_chunk(b'VER ', struct.pack('<H', scenario.ScenarioVersion.BROOD_WAR.value))
 
         # TODO: VCOD
 
-        result += b'OWNR'
-        result += struct.pack('<L', 12)
-        for i in range(8):
-            player_type = PlayerType.HUMAN if i < self.human_players else PlayerType.INACTIVE
-            result += struct.pack('B', player_type.value)
+        player_types = np.full(12, starcraft.game.PlayerType.INACTIVE.value, dtype=np.uint8)
+        player_types[: self.human_players] = starcraft.game.PlayerType.HUMAN.value
+        writer.write_chunk(b'OWNR', player_types)
 
-        for i in range(4):
-            result += struct.pack('B', PlayerType.INACTIVE.value)
+        writer.write_chunk(b'ERA ', struct.pack('<H', self.tileset.value))
+        writer.write_chunk(b'DIM ', struct.pack('<HH', self.width, self.height))
 
-        result += b'ERA '
-        result += struct.pack('<L', 2)
-        result += struct.pack('<H', self.tileset.value)
-
-        result += b'DIM '
-        result += struct.pack('<L', 4)
-        result += struct.pack('<HH', self.width, self.height)
-
-        result += b'SIDE'
-        result += struct.pack('<L', 12)
         # 4 for "neutral", 5 for "user selectable", 7 for "inactive"
-        for i in range(8):
-            side = 5 if i < self.human_players else 7
-            result += struct.pack('B', side)
-        result += struct.pack('BBBB', 7, 7, 7, 4)
+        sides = np.array([7] * 8 + [7, 7, 7, 4], dtype=np.uint8)
+        sides[: self.human_players] = 5
+        writer.write_chunk(b'SIDE', sides)
+
+        writer.write_chunk(b'MTXM', np.asarray(self.tile_indices, dtype='<u2'))
 
-        result += b'MTMX'
-        result += struct.pack('<L', self.width * self.height * 2)
-        for y in range(self.height):
-            for x in range(self.width):
-                result += struct.pack('<H', self.tiles[y, x].index)
+        writer.write_chunk(b'UNIT', np.zeros(0, UNIT_DTYPE) if units is None else np.asarray(units, UNIT_DTYPE))
+        writer.write_chunk(b'THG2', np.zeros(0, THG2_DTYPE) if thingies is None else np.asarray(thingies, THG2_DTYPE))
 
-        result += b'UNIT' # TODO: unit data
-        result += struct.pack('<L', 0)
+        strings = list(self.strings or [])
+        string_indices = []
+        for string in (self.name, self.description):
+            if string not in strings:
+                strings.append(string)
+            string_indices.append(strings.index(string) + 1)
 
-        result += b'THG2' # TODO: thingies data
-        result += struct.pack('<L', 0)
+        chunk_code, header, string_data = string_table_chunk(strings)
+        writer.write_chunk(chunk_code, header, string_data)
+        writer.write_chunk(b'SPRP', struct.pack('<HH', *string_indices))
 
-        result += b'STR ' # TODO: strings
-        result += struct.pack('<L', 2)
-        result += struct.pack('<H', 0)
+        writer.write_chunk(b'FORC', b'\0' * 16 + b'\1\1\1\1') # TODO: make this human readable
+        writer.write_chunk(b'COLR', bytes(range(8))) # TODO: make this human readable
 
-        result += b'SPRP' # TODO: name and description
-        result += struct.pack('<L', 4)
-        result += struct.pack('<HH', 0, 0)
+        return writer.position
 
-        result += b'FORC' # TODO: make this human readable
-        result += struct.pack('<L', 20)
-        result += b'\0\0\0\0\0\0\0\0\0\0\0\0\0\0\0\0\1\1\1\1'
+    def to_chunk_data(self, units=None, thingies=None):
+        """Returns the CHK data of the scenario in a preallocated bytearray"""
+        data = bytearray(self.write_chunks(None, units, thingies))
+        self.write_chunks(data, units, thingies)
+        return data
 
-        result += b'COLR' # TODO: make this human readable
-        result += struct.pack('<L', 8)
-        result += b'\0\1\2\3\4\5\6\7'
+def write_chk_files(scenarios, directory, filename_format='%05d.chk'):
+    """Writes scenarios (e.g. from a generator) to CHK files one at a time
 
-        return result
+    Each scenario is streamed straight to its file, so memory use does not grow with the
+    number of scenarios. Returns the number of written files.
+    """
+    os.makedirs(directory, exist_ok=True)
+
+    count = 0
+    for i, item in enumerate(scenarios):
+        with open(os.path.join(directory, filename_format % i), 'wb') as chk_file:
+            item.write_chunks(chk_file)
+        count += 1
+
+    return count
+
+def write_scx_file(file_path, item, compress=False):
+    """Packages a scenario as a .scx (MPQ) archive holding its `staredit\\scenario.chk`"""
+    with open(file_path, 'wb') as scx_file:
+        return mpq_writer.write_archive(scx_file, [('staredit\\scenario.chk', item.to_chunk_data())], compress)
+
+def write_scx_files(scenarios, directory, filename_format='%05d.scx', workers=4, max_in_flight=None,
+        compress=False, report=None, report_interval=5.0, processes=None):
+    """Packages scenarios (e.g. from a generator) into .scx archives on a worker pool
+
+    At most `max_in_flight` scenarios (twice the workers by default) are pulled from
+    `scenarios` ahead of the finished ones, so memory stays flat however many there are.
+    `report` is called with (written count, maps per second) every `report_interval`
+    seconds and once at the end. Returns the number of written files.
+
+    The archives are uncompressed unless `compress` is set, see `mpq_writer.write_archive`.
+    Writing uncompressed archives is pure Python work that holds the GIL, so on machines
+    with several CPUs it runs on a pool of processes by default. zlib releases the GIL, so
+    compressed archives are written on a pool of threads, which saves pickling every
+    scenario over to a worker. Set `processes` to choose the pool explicitly.
+    """
+    os.makedirs(directory, exist_ok=True)
+    max_in_flight = max_in_flight or 2 * workers
+    if processes is None:
+        processes = not compress and (os.cpu_count() or 1) > 1
+    executor_class = concurrent.futures.ProcessPoolExecutor if processes else concurrent.futures.ThreadPoolExecutor
+
+    start = last_report = time.perf_counter()
+    count = 0
+    in_flight = collections.deque()
+    with executor_class(workers) as executor:
+        for i, item in enumerate(scenarios):
+            if len(in_flight) >= max_in_flight:
+                in_flight.popleft().result()
+                count += 1
+
+            file_path = os.path.join(directory, filename_format % i)
+            in_flight.append(executor.submit(write_scx_file, file_path, item, compress))
+
+            now = time.perf_counter()
+            if report != None and now - last_report >= report_interval:
+                report(count, count / (now - start))
+                last_report = now
+
+        while in_flight:
+            in_flight.popleft().result()
+            count += 1
+
+    if report != None:
+        report(count, count / max(time.perf_counter() - start, 1e-9))
+
+    return count
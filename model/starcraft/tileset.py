@@ -5,6 +5,19 @@ import struct
 class CV5Entry:
     SIZE = 52
     EXTENSION = 'cv5'
+    DTYPE = numpy.dtype([
+        ('group', [
+            ('megagroup', '<u2'),
+            ('flags', 'u1'),
+            ('unknown', 'u1'),
+            ('left_edge', '<u2'),
+            ('top_edge', '<u2'),
+            ('right_edge', '<u2'),
+            ('bottom_edge', '<u2'),
+            ('unknown_edges', '<u2', 4),
+        ]),
+        ('megatiles', '<u2', 16),
+    ])
 
     def __init__(self, data):
         self.data = struct.unpack_from('HBBHHHHHHHH', data)
@@ -13,6 +26,7 @@ class CV5Entry:
 class WPEEntry:
     SIZE = 4
     EXTENSION = 'wpe'
+    DTYPE = numpy.dtype([('rgb', 'u1', 3), ('padding', 'u1')])
 
     def __init__(self, data):
         self.data = numpy.array(struct.unpack_from('BBB', data), dtype=numpy.uint8)
@@ -1,15 +1,67 @@
-import itertools
-import struct
+import collections.abc
+import numpy as np
 
-class StringTable(tuple):
-    def __new__(cls, tbl_file):
-        data = tbl_file.read()
-        string_count = struct.unpack_from('<H', data)[0]
-        string_offsets = struct.unpack_from('<%dH' % string_count, data, offset=2)
+class StringTable(collections.abc.Sequence):
+    """Implements a lazily decoded table of NUL-terminated strings
 
-        strings = []
-        for offset in string_offsets:
-            characters = itertools.takewhile(lambda x: x != 0, data[offset: ])
-            strings.append(''.join(map(chr, characters)))
+    The layout is shared by .tbl files and the STR chunk of scenarios: a string count,
+    followed by that many offsets of the strings from the start of the data. The extended
+    (STRx) layout uses a 32-bit count and offsets instead of 16-bit ones. Only the raw
+    data and the offsets are kept; each string is decoded on its first access.
+    """
 
-        return super(StringTable, cls).__new__(cls, strings)
+    __slots__ = ['data', 'offsets', '_strings']
+
+    ENCODING = 'ISO-8859-1'
+
+    def __init__(self, tbl_file, extended=False):
+        self._load(tbl_file.read(), extended)
+
+    @classmethod
+    def from_buffer(cls, data, extended=False):
+        string_table = cls.__new__(cls)
+        string_table._load(data, extended)
+        return string_table
+
+    def _load(self, data, extended):
+        self.data = bytes(data)
+        offset_dtype = np.dtype('<u4' if extended else '<u2')
+
+        if len(self.data) < offset_dtype.itemsize:
+            self.offsets = np.zeros(0, dtype=offset_dtype)
+        else:
+            string_count = int(np.frombuffer(self.data, dtype=offset_dtype, count=1)[0])
+            # Truncated tables are clamped to the offsets that are present
+            string_count = min(string_count, len(self.data) // offset_dtype.itemsize - 1)
+            self.offsets = np.frombuffer(self.data, dtype=offset_dtype, count=string_count, offset=offset_dtype.itemsize)
+
+        self._strings = [None] * len(self.offsets)
+
+    @property
+    def extended(self):
+        return self.offsets.dtype.itemsize == 4
+
+    def __len__(self):
+        return len(self._strings)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(len(self)))]
+
+        string = self._strings[index]
+        if string is None:
+            start = int(self.offsets[index])
+            end = self.data.find(b'\0', start)
+            if end < 0:
+                end = len(self.data)
+            string = self._strings[index] = self.data[start: end].decode(self.ENCODING)
+
+        return string
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
+
+    def __reduce__(self):
+        # Only the raw data is pickled, the strings are decoded again on access
+        return self.from_buffer, (self.data, self.extended)
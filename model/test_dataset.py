@@ -0,0 +1,51 @@
+import numpy as np
+import queue
+import tempfile
+import threading
+import time
+import unittest
+from unittest import mock
+
+from dataset import DatasetReader, DatasetWriter
+
+class DatasetReaderTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        with DatasetWriter(self.directory.name, feature_count=2) as writer:
+            for i in range(10):
+                writer.add(np.full([4, 4], i), np.zeros([4, 4, 2]))
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_batches(self):
+        batches = list(DatasetReader(self.directory.name).batches(2, epochs=2))
+        self.assertEqual(len(batches), 10)
+        self.assertEqual(batches[0][0].shape, (2, 4, 4))
+        self.assertEqual(batches[0][1].shape, (2, 4, 4, 2))
+
+    def test_batches_closed_early(self):
+        queues = []
+        def make_queue(maxsize, Queue=queue.Queue):
+            queues.append(Queue(maxsize))
+            return queues[-1]
+
+        batches = DatasetReader(self.directory.name).batches(1, epochs=1, prefetch=4)
+        with mock.patch('queue.Queue', make_queue):
+            for _ in range(6):
+                next(batches)
+
+        # Wait for the producer to fill the queue, so that it blocks on the end-of-data marker
+        deadline = time.monotonic() + 5
+        while not queues[0].full() and time.monotonic() < deadline:
+            time.sleep(0.01)
+        self.assertTrue(queues[0].full())
+
+        # Closing the generator must not wait for the blocked producer forever
+        closer = threading.Thread(target=batches.close, daemon=True)
+        closer.start()
+        closer.join(timeout=5)
+        self.assertFalse(closer.is_alive())
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,58 @@
+import os
+import struct
+import tempfile
+import unittest
+
+try:
+    import game
+    import scenario
+except ImportError: # the game modules need the mpq bindings
+    game = None
+
+if game != None:
+    class DirectoryGame(game.Game):
+        """A game without data files, reading scenarios straight from .chk files"""
+
+        def __new__(cls, game_directory):
+            return object.__new__(cls)
+
+        @classmethod
+        def data_files(cls):
+            return []
+
+        def read_scenario_file(self, filename, file_path):
+            with open(file_path, 'rb') as chk_file:
+                return chk_file.read()
+
+        def scenario_buider(self, filename, chk_file, chunk_names=None):
+            return scenario.ScenarioBuilder(self, filename, chk_file, chunk_names)
+
+@unittest.skipIf(game is None, 'the mpq bindings are not installed')
+class ScenarioCacheErrorsTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.map_path = os.path.join(self.directory.name, 'bad.chk')
+        with open(self.map_path, 'wb') as chk_file:
+            chk_file.write(b'VER ' + struct.pack('<lH', 2, 999)) # not a known version
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def scan(self):
+        scanner = DirectoryGame(self.directory.name)
+        scanner.use_cache(os.path.join(self.directory.name, 'cache'))
+        scenarios = list(scanner.iter_scenarios(self.map_path))
+        return scenarios, scanner.errors
+
+    def test_errors_reported_on_cache_hit(self):
+        cold_scenarios, cold_errors = self.scan()
+        warm_scenarios, warm_errors = self.scan()
+
+        self.assertEqual(cold_scenarios, [])
+        self.assertEqual(warm_scenarios, [])
+        self.assertEqual(len(cold_errors), 1)
+        self.assertEqual([(path, str(e)) for path, e in warm_errors], [(path, str(e)) for path, e in cold_errors])
+        self.assertIsInstance(warm_errors[0][1], scenario.ScenarioError)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,44 @@
+import numpy as np
+import unittest
+
+try:
+    import tensorflow as tf
+    from mdlstm import MdRnnWhileLoop
+except ImportError:
+    tf = None
+
+@unittest.skipIf(tf is None, 'tensorflow is not installed')
+class MdRnnWhileLoopTest(unittest.TestCase):
+    def run_loops(self, loops, h=3, w=4, batch_size=2, features=3, rnn_size=5):
+        """Returns the outputs of each loop on the same input, sharing the variables"""
+        tf.reset_default_graph()
+        input_data = tf.placeholder(tf.float32, [None, h, w, features])
+        outputs = [loop(rnn_size, input_data)[0] for loop in loops]
+        feed_dict = {input_data: np.random.RandomState(0).rand(batch_size, h, w, features)}
+
+        with tf.Session() as session:
+            session.run(tf.global_variables_initializer())
+            return session.run(outputs, feed_dict)
+
+    def test_loops_equivalent(self):
+        sequential, rolling, wavefront = self.run_loops([
+            MdRnnWhileLoop(tf.float32, return_states=True),
+            MdRnnWhileLoop(tf.float32),
+            MdRnnWhileLoop(tf.float32, wavefront=True)])
+
+        np.testing.assert_allclose(rolling, sequential, atol=1e-6)
+        np.testing.assert_allclose(wavefront, sequential, atol=1e-6)
+
+    def test_legacy_upper_state(self):
+        sequential, rolling, fixed = self.run_loops([
+            MdRnnWhileLoop(tf.float32, return_states=True, legacy_upper_state=True),
+            MdRnnWhileLoop(tf.float32, legacy_upper_state=True),
+            MdRnnWhileLoop(tf.float32)])
+
+        np.testing.assert_allclose(rolling, sequential, atol=1e-6)
+        # Only the first position of the second row and the ones it feeds into differ
+        np.testing.assert_allclose(sequential[:, 0], fixed[:, 0], atol=1e-6)
+        self.assertGreater(np.abs(sequential[:, 1, 0] - fixed[:, 1, 0]).max(), 0)
+
+if __name__ == '__main__':
+    unittest.main()
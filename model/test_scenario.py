@@ -0,0 +1,30 @@
+import struct
+import unittest
+
+from scenario import ScenarioBuilder
+
+def chunk(chunk_code, data, size=None):
+    return chunk_code + struct.pack('<l', len(data) if size is None else size) + data
+
+class ChunkDirectoryTest(unittest.TestCase):
+    def test_chunks_in_order(self):
+        data = chunk(b'VER ', b'\xcd\x00') + chunk(b'DIM ', b'\x40\x00\x40\x00') + chunk(b'VER ', b'\xce\x00')
+        self.assertEqual(ScenarioBuilder.chunk_directory(data), {
+            b'VER ': [(8, 2), (30, 2)],
+            b'DIM ': [(18, 4)],
+        })
+
+    def test_negative_size_rewinds(self):
+        # The second chunk rewinds back over its own header onto the data of the first one
+        data = chunk(b'VER ', b'\xcd\x00' + chunk(b'DIM ', b'\x40\x00\x40\x00')) + chunk(b'JUMP', b'', -20)
+        self.assertEqual(ScenarioBuilder.chunk_directory(data), {
+            b'VER ': [(8, 14)],
+            b'DIM ': [(18, 4)],
+        })
+
+    def test_negative_size_past_start(self):
+        data = chunk(b'VER ', b'\xcd\x00') + chunk(b'JUMP', b'', -100) + chunk(b'DIM ', b'\x40\x00\x40\x00')
+        self.assertEqual(ScenarioBuilder.chunk_directory(data), {b'VER ': [(8, 2)]})
+
+if __name__ == '__main__':
+    unittest.main()
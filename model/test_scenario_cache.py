@@ -0,0 +1,65 @@
+import glob
+import numpy as np
+import os
+import tempfile
+import unittest
+
+from scenario import Scenario
+from scenario_cache import ScenarioCache
+
+def make_scenario(name):
+    scenario = Scenario.__new__(Scenario)
+    scenario.name = name
+    scenario.tile_indices = np.arange(12, dtype=np.uint16).reshape(3, 4)
+    return scenario
+
+class ScenarioCacheTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def open_cache(self):
+        return ScenarioCache(os.path.join(self.directory.name, 'cache'), max_unused_runs=2)
+
+    def test_round_trip(self):
+        cache = self.open_cache()
+        cache.put(('archive', 'game', 'a.chk'), 1, [make_scenario('a')], ['message'])
+        cache.save()
+
+        scenarios, errors = self.open_cache().get(('archive', 'game', 'a.chk'), 1)
+        self.assertEqual([x.name for x in scenarios], ['a'])
+        self.assertEqual(scenarios[0].tile_indices.tolist(), make_scenario('a').tile_indices.tolist())
+        self.assertEqual(errors, ['message'])
+        self.assertIsNone(self.open_cache().get(('archive', 'game', 'a.chk'), 2))
+
+    def test_unused_entries_evicted(self):
+        cache = self.open_cache()
+        cache.put(('archive', 'game', 'used.chk'), 1, [make_scenario('used')], [])
+        cache.put(('archive', 'game', 'unused.chk'), 1, [make_scenario('unused')], [])
+        cache.save()
+
+        for _ in range(2):
+            cache = self.open_cache()
+            self.assertIsNotNone(cache.get(('archive', 'game', 'used.chk'), 1))
+            cache.save()
+
+        cache = self.open_cache()
+        self.assertEqual(list(cache.entries), [('archive', 'game', 'used.chk')])
+        self.assertEqual(len(glob.glob(os.path.join(cache.directory, cache.SEGMENT_PATTERN))), 1)
+
+    def test_deleted_files_evicted(self):
+        file_path = os.path.join(self.directory.name, 'map.chk')
+        open(file_path, 'wb').close()
+
+        cache = self.open_cache()
+        cache.put(('file', file_path), ScenarioCache.file_fingerprint(file_path), [make_scenario('map')], [])
+        cache.save()
+        os.remove(file_path)
+        cache.save()
+
+        self.assertEqual(self.open_cache().entries, {})
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,169 @@
+import numpy as np
+
+class PairCounts:
+    """Implements a sparse matrix of counts of (first, second) index pairs
+
+    Only the non-zero entries are kept, as sorted combined keys (`first * size + second`)
+    and their counts. Added pairs are buffered and merged into the sorted keys when the
+    counts are read, or once the buffer has grown as large as the stored keys, so that
+    accumulating many small batches does not sort all the keys every time.
+    """
+
+    MERGE_THRESHOLD = 2 ** 20
+
+    __slots__ = 'size', '_keys', '_counts', '_pending', '_pending_size'
+
+    def __init__(self, size):
+        self.size = size
+        self._keys = np.zeros(0, dtype=np.int64)
+        self._counts = np.zeros(0, dtype=np.int64)
+        self._pending = []
+        self._pending_size = 0
+
+    def __getstate__(self):
+        return self.size, self.keys, self.counts
+
+    def __setstate__(self, state):
+        self.size, self._keys, self._counts = state
+        self._pending = []
+        self._pending_size = 0
+
+    @property
+    def keys(self):
+        self._flush()
+        return self._keys
+
+    @property
+    def counts(self):
+        self._flush()
+        return self._counts
+
+    def add(self, first, second):
+        keys = np.asarray(first, dtype=np.int64).reshape(-1) * self.size + np.asarray(second).reshape(-1)
+        self._buffer(keys, np.ones(len(keys), dtype=np.int64))
+
+    def merge(self, other):
+        assert self.size == other.size
+        self._buffer(other.keys, other.counts)
+
+    def _buffer(self, keys, counts):
+        self._pending.append((keys, counts))
+        self._pending_size += len(keys)
+        if self._pending_size >= max(len(self._keys), self.MERGE_THRESHOLD):
+            self._flush()
+
+    def _flush(self):
+        if not self._pending:
+            return
+
+        keys = np.concatenate([self._keys] + [x for x, _ in self._pending])
+        counts = np.concatenate([self._counts] + [x for _, x in self._pending])
+        self._pending = []
+        self._pending_size = 0
+
+        self._keys, inverse = np.unique(keys, return_inverse=True)
+        self._counts = np.bincount(inverse.reshape(-1), counts).astype(np.int64)
+
+    def __getitem__(self, pair):
+        key = pair[0] * self.size + pair[1]
+        position = np.searchsorted(self.keys, key)
+        if position < len(self.keys) and self.keys[position] == key:
+            return int(self.counts[position])
+        return 0
+
+    def __len__(self):
+        return len(self.keys)
+
+    def pairs(self):
+        """Returns the (first, second, count) arrays of all non-zero entries"""
+        return self.keys // self.size, self.keys % self.size, self.counts
+
+    def row(self, first):
+        """Returns the (second, count) arrays of the non-zero entries of a row"""
+        start, stop = np.searchsorted(self.keys, [first * self.size, (first + 1) * self.size])
+        return self.keys[start: stop] % self.size, self.counts[start: stop]
+
+    def to_dense(self):
+        result = np.zeros(self.size * self.size, dtype=np.int64)
+        result[self.keys] = self.counts
+        return result.reshape([self.size, self.size])
+
+class TilesetStatistics:
+    """Implements the tile statistics of all maps of a single tileset
+
+    Tiles are counted by their raw tile index (as stored in the MTXM chunk). Horizontal
+    pairs are (tile, tile right of it), vertical pairs are (tile, tile below it). The
+    megagroup transitions count the same pairs by the megagroups of the tiles.
+    """
+
+    __slots__ = 'map_count', 'unigrams', 'horizontal', 'vertical', 'megagroup_horizontal', 'megagroup_vertical'
+
+    def __init__(self, tileset):
+        megagroup_count = int(tileset.megagroup.max()) + 1
+        self.map_count = 0
+        self.unigrams = np.zeros(len(tileset), dtype=np.int64)
+        self.horizontal = PairCounts(len(tileset))
+        self.vertical = PairCounts(len(tileset))
+        self.megagroup_horizontal = PairCounts(megagroup_count)
+        self.megagroup_vertical = PairCounts(megagroup_count)
+
+    def add(self, tileset, grids):
+        """Adds the counts of a list of 2-D tile index grids (of any sizes)"""
+        grids = [np.asarray(grid, dtype=np.int64) for grid in grids]
+        if not grids:
+            return
+
+        tiles = np.concatenate([grid.reshape(-1) for grid in grids])
+        self.unigrams += np.bincount(tiles, minlength=len(self.unigrams))[:len(self.unigrams)]
+        self.map_count += len(grids)
+
+        megagroups = tileset.megagroup[tileset.group_id].astype(np.int64)
+        for pairs, megagroup_pairs, first, second in (
+            (self.horizontal, self.megagroup_horizontal, [x[:, :-1] for x in grids], [x[:, 1:] for x in grids]),
+            (self.vertical, self.megagroup_vertical, [x[:-1] for x in grids], [x[1:] for x in grids]),
+        ):
+            first = np.concatenate([x.reshape(-1) for x in first])
+            second = np.concatenate([x.reshape(-1) for x in second])
+            pairs.add(first, second)
+            megagroup_pairs.add(megagroups[first], megagroups[second])
+
+    def merge(self, other):
+        self.map_count += other.map_count
+        self.unigrams += other.unigrams
+        self.horizontal.merge(other.horizontal)
+        self.vertical.merge(other.vertical)
+        self.megagroup_horizontal.merge(other.megagroup_horizontal)
+        self.megagroup_vertical.merge(other.megagroup_vertical)
+
+class CorpusStatistics:
+    """Implements tile co-occurrence statistics over a corpus of scenarios, by tileset
+
+    `update` can be called repeatedly with new scenarios and merges their counts into the
+    existing ones. Instances can be pickled to keep the statistics between runs.
+    """
+
+    def __init__(self):
+        self.tilesets = {}
+
+    def update(self, scenarios):
+        grids = {}
+        games = {}
+        for scenario in scenarios:
+            grids.setdefault(scenario.tileset, []).append(scenario.tile_indices)
+            games[scenario.tileset] = scenario.game
+
+        for tileset, tileset_grids in grids.items():
+            tileset_data = games[tileset].tiles(tileset)
+            if tileset not in self.tilesets:
+                self.tilesets[tileset] = TilesetStatistics(tileset_data)
+            self.tilesets[tileset].add(tileset_data, tileset_grids)
+
+    def merge(self, other):
+        for tileset, statistics in other.tilesets.items():
+            if tileset in self.tilesets:
+                self.tilesets[tileset].merge(statistics)
+            else:
+                self.tilesets[tileset] = statistics
+
+    def __getitem__(self, tileset):
+        return self.tilesets[tileset]
@@ -4,11 +4,13 @@ import os
 import struct
 
 import config
+import features
 import graphics
 
 class VF4Entry:
     SIZE = 32
     EXTENSION = 'vf4'
+    DTYPE = numpy.dtype([('flags', '<u2', 16)])
 
     def __init__(self, data):
         self.data = struct.unpack('H' * 16, data)
@@ -16,6 +18,7 @@ class VF4Entry:
 class VX4Entry:
     SIZE = 32
     EXTENSION = 'vx4'
+    DTYPE = numpy.dtype([('minitiles', '<u2', 16)])
 
     def __init__(self, data):
         self.data = struct.unpack('H' * 16, data)
@@ -23,38 +26,245 @@ class VX4Entry:
 class VR4Entry:
     SIZE = 64
     EXTENSION = 'vr4'
+    DTYPE = numpy.dtype([('pixels', 'u1', 64)])
 
     def __init__(self, data):
         self.data = struct.unpack('B' * self.SIZE, data)
 
     def to_graphics(self, wpe_entries):
-        return numpy.stack([wpe_entries[x].data for x in self.data]).reshape([8, 8, 3])
+        """Resolves the bitmap against a palette record array or a list of palette entries"""
+        if isinstance(wpe_entries, numpy.ndarray):
+            palette = wpe_entries['rgb']
+        else:
+            palette = numpy.stack([x.data for x in wpe_entries])
+        return palette[numpy.array(self.data)].reshape([8, 8, 3])
 
-class Tile:
-    __slots__ = 'group_offset', 'tile_group', 'minitiles'
+    @classmethod
+    def to_atlas(cls, vr4_entries, wpe_entries):
+        """Resolves all minitile bitmaps against the palette
+
+        Returns an array of shape [len(vr4_entries), 2, 8, 8, 3], where the second axis
+        holds the normal and the horizontally mirrored variant of each bitmap.
+        """
+        bitmaps = vr4_entries['pixels'].reshape([-1, 8, 8])
+        bitmaps = numpy.stack([bitmaps, bitmaps[:, :, ::-1]], axis=1)
+        return wpe_entries['rgb'][bitmaps]
+
+def pack_bitsets(matrix):
+    """Packs the rows of a boolean matrix into bitsets of little-endian uint64 words
+
+    Bit `column % 64` of word `column // 64` is set for every true column of a row.
+    """
+    rows, columns = matrix.shape
+    padded = numpy.zeros([rows, -(-columns // 64) * 64], dtype=bool)
+    padded[:, :columns] = matrix
+    return numpy.packbits(padded, axis=1, bitorder='little').view('<u8')
+
+def unpack_bitsets(bitsets, count):
+    """Inverts `pack_bitsets`, returning a boolean array with `count` columns"""
+    bits = numpy.unpackbits(numpy.ascontiguousarray(bitsets).view(numpy.uint8), axis=-1, bitorder='little')
+    return bits[..., :count].astype(bool)
+
+class TilesetData:
+    """Implements a structure-of-arrays view of all tiles in a tileset
+
+    Tiles are indexed the same way as in the MTXM chunk (i.e. `group_id * 16 + group_offset`).
+    Per-group columns are indexed by group id, per-minitile columns have a shape of [tiles, 4, 4].
+    Bulk consumers can index the arrays directly, while `Tile`, `TileGroup` and `Minitile`
+    expose thin views over a single row. Graphics are gathered from a shared atlas
+    (see `VR4Entry.to_atlas`) by `graphics_id` and `flipped`.
+    """
+
+    def __init__(self, megagroup, flags, edges, megatiles, vf4_data, vx4_data, atlas):
+        self.megagroup = numpy.ascontiguousarray(megagroup, dtype=numpy.uint16)
+        self.group_buildable = ((numpy.asarray(flags) >> 4) & 8 == 0).astype(numpy.uint8)
+        edges = numpy.asarray(edges, dtype=numpy.uint16)
+        self.left_edge = numpy.ascontiguousarray(edges[:, 0])
+        self.top_edge = numpy.ascontiguousarray(edges[:, 1])
+        self.right_edge = numpy.ascontiguousarray(edges[:, 2])
+        self.bottom_edge = numpy.ascontiguousarray(edges[:, 3])
+
+        megatiles = numpy.asarray(megatiles, dtype=numpy.uint16).reshape(-1)
+        group_count = len(self.megagroup)
+        self.megatile = megatiles
+        self.group_id = numpy.repeat(numpy.arange(group_count, dtype=numpy.uint16), 16)
+        self.group_offset = numpy.tile(numpy.arange(16, dtype=numpy.uint8), group_count)
+        self.buildable = self.group_buildable[self.group_id]
+
+        vx4_data = numpy.asarray(vx4_data, dtype=numpy.uint16)[megatiles].reshape(-1, 4, 4)
+        if vf4_data is None:
+            vf4_data = numpy.zeros_like(vx4_data)
+        else:
+            vf4_data = numpy.asarray(vf4_data, dtype=numpy.uint16)[megatiles].reshape(-1, 4, 4)
+
+        self.walkable = (vf4_data & 1).astype(numpy.uint8)
+        self.height = ((vf4_data >> 1) & 3).astype(numpy.uint8)
+        self.blocks_view = ((vf4_data >> 3) & 1).astype(numpy.uint8)
+        self.ramp = ((vf4_data >> 4) & 1).astype(numpy.uint8)
+        self.graphics_id = vx4_data >> 1
+        self.flipped = (vx4_data & 1).astype(numpy.uint8)
+
+        self.atlas = atlas
+        self._thumbnails = {}
+        self._feature_table = None
+
+        self.is_empty = (~self.graphics_id.reshape(-1, 16).any(axis=1)).astype(numpy.uint8)
+        self._build_vocabulary(vx4_data)
+        self._build_compatibility()
+
+    def _build_vocabulary(self, vx4_data):
+        """Computes the tile fingerprints and the deduplicated tile vocabulary
+
+        Tiles are identified by their buildability and the decoded vf4/vx4 data of their
+        minitiles (the same properties `Tile.__eq__` compares). `vocabulary` maps every
+        tile index to a dense id, numbered in order of first occurrence, so that tile
+        index grids can be converted with a single `numpy.take`.
+        """
+        vf4_flags = self.walkable | (self.height << 1) | (self.blocks_view << 3) | (self.ramp << 4)
+        packed = numpy.concatenate([
+            self.buildable.reshape(-1, 1).astype(numpy.uint16),
+            vf4_flags.reshape(-1, 16).astype(numpy.uint16),
+            vx4_data.reshape(-1, 16),
+        ], axis=1)
+
+        # 64-bit FNV-1a over the packed columns
+        self.fingerprint = numpy.full(len(packed), 0xcbf29ce484222325, dtype=numpy.uint64)
+        for column in packed.T:
+            self.fingerprint ^= column.astype(numpy.uint64)
+            self.fingerprint *= numpy.uint64(0x100000001b3)
+
+        _, first_indices, inverse = numpy.unique(packed, axis=0, return_index=True, return_inverse=True)
+        order = numpy.argsort(first_indices)
+        ranks = numpy.empty_like(order)
+        ranks[order] = numpy.arange(len(order))
+
+        self.vocabulary = ranks[inverse.reshape(-1)].astype(numpy.uint16)
+        self.vocabulary_tiles = first_indices[order].astype(numpy.uint16)
+        self.vocabulary_is_empty = self.is_empty[self.vocabulary_tiles]
+        self.vocabulary_is_doodad = self.is_doodad[self.group_id[self.vocabulary_tiles]].astype(numpy.uint8)
+
+    def _build_compatibility(self):
+        """Computes which tile groups may be placed right of and below each group
 
-    def __init__(self, tile_group, group_offset, vf4_entry, vx4_entry, minitile_graphics):
-        self.group_offset = group_offset
-        self.tile_group = tile_group
+        Terrain groups fit together when their touching edges match (e.g. the right edge
+        of a group and the left edge of the group right of it). Doodads and groups without
+        any graphics are not `placeable` and are never compatible. The results are packed
+        with `pack_bitsets`: `right_compatible[a]` has bit b set when group b may be placed
+        right of group a and `below_compatible[a]` when it may be placed below it.
+        """
+        has_graphics = ~self.is_empty.reshape(-1, 16).all(axis=1)
+        self.placeable = ~self.is_doodad & has_graphics
+        placeable_pairs = self.placeable[:, numpy.newaxis] & self.placeable[numpy.newaxis, :]
 
-        minitiles = [Minitile(vf4_entry.data[i], vx4_entry.data[i], minitile_graphics) for i in range(16)]
-        self.minitiles = numpy.array(minitiles, dtype=object).reshape(4, 4)
+        self.right_compatible = pack_bitsets((self.right_edge[:, numpy.newaxis] == self.left_edge) & placeable_pairs)
+        self.below_compatible = pack_bitsets((self.bottom_edge[:, numpy.newaxis] == self.top_edge) & placeable_pairs)
+
+    def to_vocabulary(self, tile_indices):
+        """Maps a grid of tile indices to vocabulary ids"""
+        return numpy.take(self.vocabulary, tile_indices)
+
+    @classmethod
+    def from_entries(cls, group_entries, vf4_entries, vx4_entries, atlas):
+        """Builds the tileset from the record arrays returned by `Game.process_tileset_file`"""
+        group_data = group_entries['group']
+        edges = [group_data[x] for x in ('left_edge', 'top_edge', 'right_edge', 'bottom_edge')]
+
+        return cls(
+            group_data['megagroup'],
+            group_data['flags'],
+            numpy.stack(edges, axis=1),
+            group_entries['megatiles'],
+            None if vf4_entries is None else vf4_entries['flags'],
+            vx4_entries['minitiles'],
+            atlas)
 
     @property
-    def index(self):
-        return self.group_id * 16 + self.group_offset
+    def is_doodad(self):
+        return self.megagroup == 1
+
+    def thumbnails(self, scale):
+        """Returns the graphics of all tiles downscaled by `scale` (2, 4, 8, 16 or 32)
+
+        Pixels are averaged per minitile first, so the per-tile arrays are only
+        built once per scale and then shared by every render.
+        """
+        if scale not in self._thumbnails:
+            size = graphics.TILE_SIZE // scale
+            atlas = self.atlas.astype(numpy.float32)
+            channels = atlas.shape[-1]
+
+            if scale <= graphics.MINITILE_SIZE:
+                minitile_size = graphics.MINITILE_SIZE // scale
+                atlas = atlas.reshape([-1, 2, minitile_size, scale, minitile_size, scale, channels])
+                atlas = atlas.mean(axis=(3, 5)).round().astype(self.atlas.dtype)
+                minitiles = atlas[self.graphics_id, self.flipped]
+                thumbnails = minitiles.transpose([0, 1, 3, 2, 4, 5])
+            else:
+                block_size = scale // graphics.MINITILE_SIZE
+                minitiles = atlas.mean(axis=(2, 3))[self.graphics_id, self.flipped]
+                minitiles = minitiles.reshape([-1, size, block_size, size, block_size, channels])
+                thumbnails = minitiles.mean(axis=(2, 4)).round().astype(self.atlas.dtype)
+
+            self._thumbnails[scale] = numpy.ascontiguousarray(thumbnails.reshape([-1, size, size, channels]))
+
+        return self._thumbnails[scale]
+
+    @property
+    def feature_table(self):
+        """The per-tile feature table (see `features.build_feature_table`), built on first access"""
+        if self._feature_table is None:
+            self._feature_table = features.build_feature_table(self)
+        return self._feature_table
+
+    def __len__(self):
+        return len(self.group_id)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [Tile(self, i) for i in range(*index.indices(len(self)))]
+
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError('tile index out of range')
+
+        return Tile(self, index)
+
+    def __iter__(self):
+        return (Tile(self, i) for i in range(len(self)))
+
+class Tile:
+    __slots__ = 'data', 'index'
+
+    def __init__(self, data, index):
+        self.data = data
+        self.index = int(index)
 
     @property
     def group_id(self):
-        return self.tile_group.group_id
+        return int(self.data.group_id[self.index])
+
+    @property
+    def group_offset(self):
+        return int(self.data.group_offset[self.index])
+
+    @property
+    def tile_group(self):
+        return TileGroup(self.data, self.group_id)
 
     @property
     def buildable(self):
-        return self.tile_group.buildable
+        return bool(self.data.buildable[self.index])
+
+    @property
+    def minitiles(self):
+        minitiles = [Minitile(self.data, self.index, y, x) for y in range(4) for x in range(4)]
+        return numpy.array(minitiles, dtype=object).reshape(4, 4)
 
     @property
     def graphics(self):
-        return graphics.tile(self.minitiles)
+        minitiles = self.data.atlas[self.data.graphics_id[self.index], self.data.flipped[self.index]]
+        return minitiles.transpose([0, 2, 1, 3, 4]).reshape([32, 32, -1])
 
     @property
     def is_doodad(self):
@@ -62,7 +272,15 @@ class Tile:
 
     @property
     def is_empty(self):
-        return numpy.count_nonzero(numpy.vectorize(lambda x: x.graphics_id)(self.minitiles)) == 0
+        return bool(self.data.is_empty[self.index])
+
+    @property
+    def fingerprint(self):
+        return int(self.data.fingerprint[self.index])
+
+    @property
+    def vocabulary_id(self):
+        return int(self.data.vocabulary[self.index])
 
     def __repr__(self):
         return '<%s.%s - megagroup: %d, group %d, item %d>' % (
@@ -73,57 +291,99 @@ class Tile:
             self.group_offset)
 
     def __hash__(self):
-        result = 0
-        for _, minitile in numpy.ndenumerate(self.minitiles):
-            result = result * 37 + hash(minitile)
-        return result
+        return self.fingerprint
 
     def __eq__(self, other):
-        return self.buildable == other.buildable and numpy.array_equal(self.minitiles, other.minitiles)
+        if self.data is other.data:
+            return self.vocabulary_id == other.vocabulary_id
+
+        return self.fingerprint == other.fingerprint and self.buildable == other.buildable and all(
+            numpy.array_equal(getattr(self.data, x)[self.index], getattr(other.data, x)[other.index])
+            for x in Minitile.COLUMNS)
 
 class TileGroup:
-    __slots__ = 'megagroup', 'group_id', 'buildable', '__dict__'
+    __slots__ = 'data', 'group_id'
 
-    def __init__(self, group_id, cv5_entry):
-        self.megagroup = cv5_entry.data[0]
+    def __init__(self, data, group_id):
+        self.data = data
         self.group_id = group_id
-        self.buildable = not bool((cv5_entry.data[1] >> 4) & 8)
 
-        if self.is_doodad:
-            self.overlay_id = cv5_entry.data[3]
-        else:
-            self.left_edge = cv5_entry.data[3]
-            self.top_edge = cv5_entry.data[4]
-            self.right_edge = cv5_entry.data[5]
-            self.bottom_edge = cv5_entry.data[6]
+    @property
+    def megagroup(self):
+        return int(self.data.megagroup[self.group_id])
+
+    @property
+    def buildable(self):
+        return bool(self.data.group_buildable[self.group_id])
 
     @property
     def is_doodad(self):
         return self.megagroup == 1
 
+    @property
+    def overlay_id(self):
+        return int(self.data.left_edge[self.group_id])
+
+    @property
+    def left_edge(self):
+        return int(self.data.left_edge[self.group_id])
+
+    @property
+    def top_edge(self):
+        return int(self.data.top_edge[self.group_id])
+
+    @property
+    def right_edge(self):
+        return int(self.data.right_edge[self.group_id])
+
+    @property
+    def bottom_edge(self):
+        return int(self.data.bottom_edge[self.group_id])
+
 class Minitile:
-    __slots__ = 'walkable', 'height', 'blocks_view', 'ramp', 'graphics_id', 'graphics_flipped', 'graphics'
+    __slots__ = 'data', 'tile_index', 'y', 'x'
+
+    COLUMNS = 'walkable', 'height', 'blocks_view', 'ramp', 'graphics_id', 'flipped'
+
+    def __init__(self, data, tile_index, y, x):
+        self.data = data
+        self.tile_index = tile_index
+        self.y = y
+        self.x = x
+
+    def _column(self, name):
+        return getattr(self.data, name)[self.tile_index, self.y, self.x]
+
+    @property
+    def walkable(self):
+        return bool(self._column('walkable'))
+
+    @property
+    def height(self):
+        return self._column('height') / 4
+
+    @property
+    def blocks_view(self):
+        return bool(self._column('blocks_view'))
+
+    @property
+    def ramp(self):
+        return bool(self._column('ramp'))
 
-    def __init__(self, vf4_entry, vx4_entry, minitile_graphics):
-        self.walkable = bool(vf4_entry & 1)
-        self.height = ((vf4_entry >> 1) & 3) / 4
-        self.blocks_view = bool(vf4_entry & 8)
-        self.ramp = bool(vf4_entry & 16)
-        self.graphics_id = vx4_entry >> 1
-        self.graphics_flipped = bool(vx4_entry & 1)
+    @property
+    def graphics_id(self):
+        return int(self._column('graphics_id'))
+
+    @property
+    def graphics_flipped(self):
+        return bool(self._column('flipped'))
 
-        self.graphics = minitile_graphics[self.graphics_id]
-        if self.graphics_flipped:
-            self.graphics = numpy.fliplr(self.graphics)
+    @property
+    def graphics(self):
+        return self.data.atlas[self.graphics_id, self._column('flipped')]
 
     def __hash__(self):
         return hash(self.graphics_id)
 
     def __eq__(self, other):
-        return \
-            self.walkable == other.walkable and \
-            self.height == other.height and \
-            self.blocks_view == other.blocks_view and \
-            self.ramp == other.ramp and \
-            self.graphics_id == other.graphics_id and \
-            self.graphics_flipped == other.graphics_flipped
+        return all(self._column(x) == other._column(x) for x in self.COLUMNS)
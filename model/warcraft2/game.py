@@ -28,20 +28,20 @@ class Game(game.MpqBasedGame):
     def data_files(cls):
         return ['War2Dat.mpq']
 
-    def process_file(self, filename, file_path):
+    def read_scenario_file(self, filename, file_path):
         if filename.endswith('.pud'):
             with open(file_path, 'rb') as chk_file:
-                return self.process_chk(filename, chk_file)
+                return chk_file.read()
         else:
-            return []
+            return None
 
     def scenario_filenames(self):
         return \
             ['Campaign\\' + x % i for x, i in product(['Human\\Human%02d.pud', 'Orc\\Orc%02d.pud'], range(1, 15))] + \
             ['Campaign\\' + x % i for x, i in product(['XHuman\\2XHum%02d.pud', 'XOrc\\2XOrc%02d.pud'], range(1, 13))]
 
-    def scenario_buider(self, filename, chk_file):
-        return warcraft2.scenario.ScenarioBuilder(self, filename, chk_file)
+    def scenario_buider(self, filename, chk_file, chunk_names=None):
+        return warcraft2.scenario.ScenarioBuilder(self, filename, chk_file, chunk_names)
 
     def tileset_basename(self, tileset):
         return {
@@ -54,19 +54,12 @@ class Game(game.MpqBasedGame):
     def tiles(self, tileset):
         if tileset not in self._tiles_cache:
             cv4_entries = self.process_tileset_file(tileset, warcraft2.tileset.CV4Entry)
-            dummy_vf4_entry = VF4Entry(b'0' * VF4Entry.SIZE)
             vx4_entries = self.process_tileset_file(tileset, VX4Entry)
             vr4_entries = self.process_tileset_file(tileset, VR4Entry)
             ppl_entries = self.process_tileset_file(tileset, warcraft2.tileset.PPLEntry)
 
-            minitile_graphics = [vr4_entry.to_graphics(ppl_entries) for vr4_entry in vr4_entries]
+            atlas = VR4Entry.to_atlas(vr4_entries, ppl_entries)
 
-            self._tiles_cache[tileset] = []
-            for group_id, cv4_entry in enumerate(cv4_entries):
-                tile_group = TileGroup(group_id, cv4_entry)
-                for group_offset, megatile in enumerate(cv4_entry.megatiles):
-                    vx4_entry = vx4_entries[megatile]
-                    tile = Tile(tile_group, group_offset, dummy_vf4_entry, vx4_entry, minitile_graphics)
-                    self._tiles_cache[tileset].append(tile)
+            self._tiles_cache[tileset] = TilesetData.from_entries(cv4_entries, None, vx4_entries, atlas)
 
         return self._tiles_cache[tileset]
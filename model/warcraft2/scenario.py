@@ -2,7 +2,11 @@ import scenario
 
 class ScenarioBuilder(scenario.ScenarioBuilder):
     def handle_DESC(self, data):
-        self.description = data.decode('ISO-8859-1').strip('\0')
+        self.description = bytes(data).decode('ISO-8859-1').strip('\0')
+
+    def to_header(self):
+        self.alliances = 1
+        return super().to_header()
 
     def to_scenario(self):
         self.process_MTMX()
@@ -7,6 +7,19 @@ import tileset
 class CV4Entry:
     SIZE = 42
     EXTENSION = 'cv4'
+    DTYPE = numpy.dtype([
+        ('megatiles', '<u2', 16),
+        ('group', [
+            ('megagroup', 'u1'),
+            ('flags', 'u1'),
+            ('unknown', 'u1'),
+            ('left_edge', 'u1'),
+            ('top_edge', 'u1'),
+            ('right_edge', 'u1'),
+            ('bottom_edge', 'u1'),
+            ('unknown_edges', 'u1', 3),
+        ]),
+    ])
 
     def __init__(self, data):
         self.data = struct.unpack_from('10B', data, offset=32)
@@ -15,6 +28,7 @@ class CV4Entry:
 class PPLEntry:
     SIZE = 3
     EXTENSION = 'ppl'
+    DTYPE = numpy.dtype([('rgb', 'u1', 3)])
 
     def __init__(self, data):
         self.data = numpy.array(struct.unpack_from('BBB', data), dtype=numpy.uint8)